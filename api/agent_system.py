@@ -1,10 +1,17 @@
 import os
+import re
 import json
+import asyncio
+import hashlib
 import logging
+import random
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
-import google.generativeai as genai
-from pinecone import Pinecone
 from api.rule_engine import RuleEngine
+from api.semantic_cache import SemanticCache, quantize
+from api.embedding_batcher import EmbeddingBatcher
+from api.session_store import SessionStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,11 +21,52 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Helpers
+_WHITESPACE_RE = re.compile(r'\s')
+
 def clean_key(val):
     if not val: return ""
     if '=' in val: val = val.split('=')[-1]
-    import re
-    return re.sub(r'[\s\n\r\t]', '', val).strip("'\" ")
+    # Quotes are only stripped at the edges
+    return _WHITESPACE_RE.sub('', val).strip("'\" ")
+
+def _question_key(message, previous=None):
+    """
+    Exact-repeat key: case, spacing and surrounding ¿?¡!. don't change the question.
+    The previous user turn is part of it, since retrieval attaches it to follow-ups.
+    """
+    def normalize(text):
+        return " ".join(text.lower().split()).strip("¿?¡!. ")
+    normalized = normalize(message) if previous is None else f"{normalize(previous)}\n{normalize(message)}"
+    return hashlib.sha256(normalized.encode('utf-8')).digest()
+
+def _previous_user_turn(message, history):
+    """Last user turn before `message` (retrieval attaches it to follow-up questions), or None."""
+    return next((m['content'] for m in reversed(history) if m['role'] == 'user' and m['content'] != message), None)
+
+# API settings read (and cleaned) in one pass at startup: name -> default
+_API_ENV = {
+    'GOOGLE_API_KEY': None,
+    'PINECONE_API_KEY': None,
+    'PINECONE_INDEX_NAME': None,
+    'PINECONE_NAMESPACE': 'default',
+}
+
+# Fallback "is this an answer to the flow?" keywords. si/no must be whole words
+# (plain substring checks matched "no" inside almost any sentence).
+_FLOW_ANSWER_RE = re.compile(r'cambia|botella|caja|\bs[ií]\b|\bno\b', re.IGNORECASE)
+
+# RAG prompt around the retrieved context; joined in one pass instead of an f-string
+_RAG_PROMPT_PREFIX = (
+    "Responde a la pregunta del usuario basándote ÚNICAMENTE en el siguiente contexto.\n"
+    "Responde en Español de forma clara y concisa.\n"
+    "Contexto:\n"
+)
+_RAG_PROMPT_MID = "\n\nPregunta Usuario: "
+
+# Customer attributes that rarely change within a session. They go in the byte-stable
+# prompt prefix (with the policy text) so Gemini's prefix caching can reuse it; the
+# time-varying rest of the context goes at the end.
+_STABLE_CONTEXT_KEYS = ('plan', 'tipo_cliente', 'canal', 'route_type', 'producto')
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -30,32 +78,217 @@ class AgentSystem:
         self._setup_apis()
         self.stop_engine = RuleEngine(STOP_RULES_PATH)
         self.urgent_engine = RuleEngine(URGENT_RULES_PATH)
-        
-        # System Instructions for extraction
-        self.extraction_model = genai.GenerativeModel('models/gemini-2.0-flash')
-        self.chat_model = genai.GenerativeModel('models/gemini-2.0-flash', system_instruction="Eres un asistente virtual de Aquaservice. Tu misión es ayudar al cliente con sus pedidos, dudas y gestiones. Responde SIEMPRE en español de forma amable y profesional.")
+        # Policy manuals are read once here: file reads in the request path would block the event loop
+        self.policy_texts = {
+            "STOP": self._load_policy(STOP_RULES_PATH.replace('rules_stop_reparto.json', 'policy_stop_reparto.txt')),
+            "URGENT": self._load_policy(URGENT_RULES_PATH.replace('rules_aviso_urgente.json', 'policy_aviso_urgente.txt')),
+        }
+        # Conversation turns per client session (history kept server-side between requests)
+        self.sessions = SessionStore(max_sessions=int(os.getenv('SESSION_STORE_SIZE', '1000')))
+        # Query embeddings from concurrent requests are coalesced into one API call.
+        # Under low traffic the window is pure added latency, so EMBED_BATCH_WINDOW_MS=0 disables waiting.
+        self.embedder = EmbeddingBatcher(
+            'models/text-embedding-004', "retrieval_query",
+            window_ms=int(os.getenv('EMBED_BATCH_WINDOW_MS', '15')),
+            max_batch=int(os.getenv('EMBED_BATCH_MAX', '32'))
+        )
+        # Exact-text memo of query embeddings: sha256(text) -> vector (LRU)
+        self._embed_cache = OrderedDict()
+        self._embed_cache_size = int(os.getenv('EMBED_CACHE_SIZE', '2048'))
+        # Cached answers expire so knowledge-base re-syncs reach users (seconds)
+        answer_ttl = float(os.getenv('ANSWER_CACHE_TTL', '3600'))
+        self.rag_cache = SemanticCache(
+            max_entries=int(os.getenv('SEMANTIC_CACHE_SIZE', '1000')),
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95')),
+            ttl=answer_ttl
+        )
+        # Front-door cache of whole FAQ answers keyed by the embedding of the retrieval text
+        # (previous user turn + message): a hit skips retrieval and generation, and is served
+        # once the concurrent intent classification confirms a plain FAQ turn
+        self.answer_cache = SemanticCache(
+            max_entries=int(os.getenv('SEMANTIC_CACHE_SIZE', '1000')),
+            threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.92')),
+            ttl=answer_ttl
+        )
+        # ...and in front of it, verbatim repeats by normalized text: no embedding call either.
+        # _question_key(message, previous) -> (expiry, response), LRU
+        self._exact_answers = OrderedDict()
+        self._answer_ttl = answer_ttl
+        # Pinecone top-k per query vector: blake2b(int8 vector) -> (expiry, matches), LRU.
+        # Short TTL: the batch sync updates the index without notifying the API
+        self._query_cache = OrderedDict()
+        self._query_cache_size = int(os.getenv('QUERY_CACHE_SIZE', '5000'))
+        self._query_cache_ttl = float(os.getenv('QUERY_CACHE_TTL', '600'))
         
     def _setup_apis(self):
-        google_key = clean_key(os.getenv('GOOGLE_API_KEY'))
-        pc_key = clean_key(os.getenv('PINECONE_API_KEY'))
-        self.index_name = clean_key(os.getenv('PINECONE_INDEX_NAME'))
-        self.pc_namespace = clean_key(os.getenv('PINECONE_NAMESPACE', 'default'))
+        # Heavy SDKs are imported here (not at module level) so importing the app stays cheap;
+        # the FastAPI lifespan builds the AgentSystem on boot.
+        import google.generativeai as genai
+        from pinecone import Pinecone
+
+        env = {k: clean_key(os.environ.get(k, default)) for k, default in _API_ENV.items()}
+        missing = [k for k, v in env.items() if not v]
+        if missing:
+            raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
+        pc_key = env['PINECONE_API_KEY']
+        self.index_name = env['PINECONE_INDEX_NAME']
+        self.pc_namespace = env['PINECONE_NAMESPACE']
 
-        genai.configure(api_key=google_key)
+        genai.configure(api_key=env['GOOGLE_API_KEY'])
+        self._pc_key = pc_key
+        # Sync client: fallback when the asyncio client isn't open (no lifespan, e.g. lazy init)
         self.pc = Pinecone(api_key=pc_key)
         self.index = self.pc.Index(self.index_name)
+        self.pc_async = None
+        self.async_index = None
+
+        # System Instructions for extraction
+        self.extraction_model = genai.GenerativeModel('models/gemini-2.0-flash')
+        self.chat_model = genai.GenerativeModel('models/gemini-2.0-flash', system_instruction="Eres un asistente virtual de Aquaservice. Tu misión es ayudar al cliente con sus pedidos, dudas y gestiones. Responde SIEMPRE en español de forma amable y profesional.")
 
-    async def process_request(self, message: str, history: list, context: dict, flow_step: str = None):
+    async def warm_up(self):
+        """
+        Opens the asyncio Pinecone client (one pooled keep-alive connection set shared by
+        all requests) and touches the index so the first user request doesn't pay the
+        TLS handshake.
+        """
+        try:
+            from pinecone import PineconeAsyncio
+            self.pc_async = PineconeAsyncio(api_key=self._pc_key)
+            desc = await self.pc_async.describe_index(self.index_name)
+            self.async_index = self.pc_async.IndexAsyncio(host=desc.host)
+            await self.async_index.describe_index_stats()
+        except Exception as e:
+            logger.warning("Pinecone async warm-up failed, using sync client: %s", e)
+            await self.aclose()
+
+    async def aclose(self):
+        await self.embedder.aclose()
+        if self.async_index is not None:
+            await self.async_index.close()
+            self.async_index = None
+        if self.pc_async is not None:
+            await self.pc_async.close()
+            self.pc_async = None
+
+    async def _query_index(self, vector):
+        """
+        Top-k matches for `vector`. Keyed by the int8-quantized vector, so retries and
+        repeated questions whose embeddings differ only by float noise reuse the result.
+        """
+        key = hashlib.blake2b(quantize(vector).tobytes(), digest_size=16).digest()
+        entry = self._query_cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._query_cache.move_to_end(key)
+            return entry[1]
+
+        if self.async_index is not None:
+            res = await self.async_index.query(vector=vector, top_k=3, include_metadata=True, namespace=self.pc_namespace)
+        else:
+            res = await asyncio.to_thread(self.index.query, vector=vector, top_k=3, include_metadata=True, namespace=self.pc_namespace)
+        matches = list(res.matches)
+        self._query_cache[key] = (time.monotonic() + self._query_cache_ttl, matches)
+        self._query_cache.move_to_end(key)
+        while len(self._query_cache) > self._query_cache_size:
+            self._query_cache.popitem(last=False)
+        return matches
+
+    async def process_request(self, message: str, history: list, context: dict, flow_step: str = None, on_delta=None, session_id: str = None, context_delta: dict = None, session_version: int = None):
         """
         Main entry point.
         1. Analyze Turn (Is it an answer to current flow? or a new intent?)
         2. Handle Interruption vs Flow Continuation.
         3. Route to specific Agent logic.
+
+        If `on_delta` (async callable) is given, the final answer text is streamed
+        to it chunk by chunk while it is being generated.
+        If `session_id` is given, the conversation history and context are kept server-side
+        for that session: the client sends its history (None otherwise) only to seed or resync
+        the session and may send `context_delta` (changed keys) instead of the full `context`.
         """
-        
-        # 1. Analyze the turn structure
-        analysis = await self._analyze_turn(message, history, flow_step)
-        logger.info(f"Turn Analysis: {analysis}")
+        if session_id:
+            history, context = self.sessions.open(session_id, history, context, context_delta, session_version)
+        else:
+            history = history or []
+            if context is None:
+                context = dict(context_delta or {})
+
+        # Outside a flow, FAQ answers only depend on the question and the previous user turn
+        # (retrieval attaches it to follow-ups), not on the context, so repeats and paraphrases
+        # of an already answered question are served from the cache.
+        response = q = key = analysis_task = None
+        if not flow_step:
+            previous = _previous_user_turn(message, history)
+            retrieval_text = f"{previous}\n{message}" if previous else message
+            key = _question_key(message, previous)
+            response = self._exact_answer(key)
+            if response is None:
+                # Intent classification doesn't need the embedding: both run at once
+                # (a miss pays max(), not the sum)
+                analysis_task = asyncio.create_task(self._analyze_turn(message, history, flow_step))
+                try:
+                    q = quantize((await self._embed_queries([retrieval_text]))[0])
+                except BaseException:
+                    analysis_task.cancel()
+                    raise
+                response = self.answer_cache.get(q)
+                if response is not None:
+                    # A stop/urgent request worded like a cached FAQ must still enter its flow
+                    analysis = await analysis_task
+                    if analysis.get("intent") == "FAQ" and not analysis.get("is_interruption", False):
+                        self._remember_answer(key, response)
+                    else:
+                        response = None
+        if response is None:
+            response = await self._route_turn(message, history, context, flow_step, on_delta, analysis_task)
+            if key is not None and response.get("source") == "RAG" and not response.get("flow_step"):
+                self.answer_cache.put(q, response)
+                self._remember_answer(key, response)
+
+        if session_id:
+            self.sessions.record(session_id, message, response.get("answer", ""), response.get("context_updates"))
+        return response
+
+    def _exact_answer(self, key):
+        entry = self._exact_answers.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._exact_answers[key]
+            return None
+        self._exact_answers.move_to_end(key)
+        return entry[1]
+
+    def _remember_answer(self, key, response):
+        self._exact_answers[key] = (time.monotonic() + self._answer_ttl, response)
+        self._exact_answers.move_to_end(key)
+        while len(self._exact_answers) > self.answer_cache.max_entries:
+            self._exact_answers.popitem(last=False)
+
+    async def stream_request(self, message: str, history: list, context: dict, flow_step: str = None, session_id: str = None, context_delta: dict = None, session_version: int = None):
+        """
+        Async generator version of `process_request`: yields `{"delta": text}` events while
+        the answer is being generated and a last `{"final": response}` event.
+        Closing the generator (e.g. client disconnected) cancels the request.
+        """
+        queue = asyncio.Queue()
+
+        async def on_delta(text):
+            queue.put_nowait({"delta": text})
+
+        task = asyncio.create_task(self.process_request(message, history, context, flow_step, on_delta=on_delta, session_id=session_id, context_delta=context_delta, session_version=session_version))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (event := await queue.get()) is not None:
+                yield event
+            yield {"final": task.result()}
+        finally:
+            task.cancel()
+
+    async def _route_turn(self, message, history, context, flow_step, on_delta, analysis_task=None):
+        # 1. Analyze the turn structure (possibly already started by process_request)
+        analysis = await (analysis_task or self._analyze_turn(message, history, flow_step))
+        logger.info("Turn Analysis: %s", analysis)
         
         intent = analysis.get("intent")
         is_interruption = analysis.get("is_interruption", False)
@@ -72,7 +305,7 @@ class AgentSystem:
             # Execute the interrupting intent
             if intent == "FAQ":
                 # We handle the FAQ normally
-                sub_response = await self._handle_rag(message, history)
+                sub_response = await self._handle_rag(message, history, on_delta)
                 
                 # We append a "Resumption Hint" to the answer
                 # And we RETURN the ORIGINAL flow_step so frontend stays in that state
@@ -98,14 +331,14 @@ class AgentSystem:
 
         # 3. Routing
         if intent == "STOP_DELIVERY" or (flow_step and flow_step.startswith("STOP_") and not is_interruption):
-            response = await self._handle_stop_delivery(message, context)
+            response = await self._handle_stop_delivery(message, context, on_delta)
         elif intent == "URGENT_NOTICE" or (flow_step and flow_step.startswith("URGENT_") and not is_interruption):
-            response = await self._handle_urgent_notice(message, context)
+            response = await self._handle_urgent_notice(message, context, on_delta)
         elif intent == "FAQ":
-            response = await self._handle_rag(message, history)
+            response = await self._handle_rag(message, history, on_delta)
         else:
             # Fallback / Chat
-            response["answer"] = await self._simple_chat(message, history)
+            response["answer"] = await self._simple_chat(message, history, on_delta)
             response["source"] = "CHAT"
 
         return response
@@ -139,8 +372,8 @@ class AgentSystem:
         }}
         """
         try:
-            res = self.chat_model.generate_content(prompt)
-            text = res.text.replace('```json', '').replace('```', '').strip()
+            text = await self._run_model(prompt)
+            text = text.replace('```json', '').replace('```', '').strip()
             data = json.loads(text)
             
             if data["classification"] == "ANSWER_FLOW":
@@ -150,10 +383,9 @@ class AgentSystem:
             else:
                 return {"intent": data["detected_intent"], "is_interruption": False} # Context Switch
         except Exception as e:
-            logger.error(f"Error in analyze_turn: {e}")
+            logger.error("Error in analyze_turn: %s", e)
             # Fallback: Check keywords manually
-            msg_lower = message.lower()
-            if "cambia" in msg_lower or "botella" in msg_lower or "caja" in msg_lower or "si" in msg_lower or "no" in msg_lower:
+            if _FLOW_ANSWER_RE.search(message):
                  return {"intent": "ANSWER_FLOW", "is_interruption": False}
             
             intent = await self._classify_intent(message, history)
@@ -177,14 +409,14 @@ class AgentSystem:
 
         Category:
         """
-        res = self.chat_model.generate_content(prompt)
-        text = res.text.strip().upper()
+        text = await self._run_model(prompt)
+        text = text.strip().upper()
         if "STOP" in text: return "STOP_DELIVERY"
         if "URGENT" in text: return "URGENT_NOTICE"
         if "FAQ" in text: return "FAQ"
         return "CHAT"
 
-    async def _handle_stop_delivery(self, message, context):
+    async def _handle_stop_delivery(self, message, context, on_delta=None):
         # 1. Check Missing Info
         missing = self.stop_engine.get_missing_info(context)
         
@@ -218,7 +450,7 @@ class AgentSystem:
         decision = self.stop_engine.evaluate(context)
         
         if decision:
-             answer = await self._generate_decision_response(decision, "STOP_DELIVERY", context)
+             answer = await self._generate_decision_response(decision, "STOP_DELIVERY", context, on_delta)
              return {
                  "answer": answer,
                  "context_updates": context,
@@ -235,7 +467,7 @@ class AgentSystem:
             "debug_info": {"error": "No rule matched"}
         }
 
-    async def _handle_urgent_notice(self, message, context):
+    async def _handle_urgent_notice(self, message, context, on_delta=None):
         # 1. Check Missing Info
         missing = self.urgent_engine.get_missing_info(context)
         
@@ -273,7 +505,7 @@ class AgentSystem:
         # 2. Evaluate Rules
         decision = self.urgent_engine.evaluate(context)
         if decision:
-            answer = await self._generate_decision_response(decision, "URGENT_NOTICE", context)
+            answer = await self._generate_decision_response(decision, "URGENT_NOTICE", context, on_delta)
             return {
                 "answer": answer,
                 "context_updates": context,
@@ -290,37 +522,111 @@ class AgentSystem:
              "debug_info": {"error": "No rule matched"}
         }
 
-    async def _handle_rag(self, message, history):
-        embed = genai.embed_content(model='models/text-embedding-004', content=message, task_type="retrieval_query")
-        results = self.index.query(vector=embed['embedding'], top_k=3, include_metadata=True, namespace=self.pc_namespace)
-        matches = [m for m in results.matches if m.score > 0.45]
-        context_text = "\n".join([m.metadata.get('text', '') for m in matches])
-        
-        prompt = f"""
-        Responde a la pregunta del usuario basándote ÚNICAMENTE en el siguiente contexto.
-        Responde en Español de forma clara y concisa.
-        Contexto:
-        {context_text}
-        
-        Pregunta Usuario: {message}
-        """
-        res = self.chat_model.generate_content(prompt)
-        sources = [{"name": m.metadata.get('file_name', 'Doc'), "score": round(m.score*100, 1)} for m in matches]
+    async def _handle_rag(self, message, history, on_delta=None):
+        texts = [message]
+        previous = _previous_user_turn(message, history)
+        if previous:
+            # Follow-ups ("¿y cuánto cuesta?") retrieve better with the previous user turn attached
+            texts.append(f"{previous}\n{message}")
+
+        vectors = await self._embed_queries(texts)
+        # int8 copy is only used as cache key; Pinecone gets the original float vector.
+        # The last variant is the most specific one (includes the previous turn if any).
+        q = quantize(vectors[-1])
+        cached = self.rag_cache.get(q)
+        if cached:
+            return cached
+
+        results = await asyncio.gather(*(self._query_index(v) for v in vectors))
+        # Union of both result sets, best score per vector id
+        best_matches = {}
+        for res_matches in results:
+            for m in res_matches:
+                if m.score > 0.45 and (m.id not in best_matches or m.score > best_matches[m.id].score):
+                    best_matches[m.id] = m
+        matches = sorted(best_matches.values(), key=lambda m: m.score, reverse=True)[:3]
+
+        # Single pass over the matches for both the prompt context and the sources.
+        # One source per file: matches come sorted by score, so setdefault keeps the best one
+        ctx_parts, best = [], {}
+        for m in matches:
+            md = m.metadata or {}
+            ctx_parts.append(md.get('text', ''))
+            best.setdefault(md.get('file_name', 'Doc'), round(m.score*100, 1))
+        context_text = "\n".join(ctx_parts)
+        sources = [{"name": f, "score": score} for f, score in best.items()]
         
-        return {
-            "answer": res.text,
+        prompt = "".join((_RAG_PROMPT_PREFIX, context_text, _RAG_PROMPT_MID, message))
+        answer = await self._run_model(prompt, on_delta=on_delta)
+
+        response = {
+            "answer": answer,
             "context_updates": {},
             "flow_step": None,
             "source": "RAG",
             "sources_data": sources,
             "debug_info": {"context_used": [s['name'] for s in sources]}
         }
-    async def _simple_chat(self, message, history):
-        # Basic chat
-        gemini_history = [{"role": "user" if m['role'] == "user" else "model", "parts": [m['content']]} for m in history]
-        chat = self.chat_model.start_chat(history=gemini_history)
-        res = chat.send_message(message)
-        return res.text
+        self.rag_cache.put(q, response)
+        return response
+
+    async def _embed_queries(self, texts):
+        """
+        Embeds retrieval queries through the shared batcher, skipping texts whose vector
+        is already memoized (repeated questions don't hit the embedding API at all).
+        """
+        keys = [hashlib.sha256(t.encode('utf-8')).digest() for t in texts]
+        # Hits are copied before awaiting: concurrent requests may evict them meanwhile
+        found = {k: self._embed_cache[k] for k in keys if k in self._embed_cache}
+        missing = [(k, t) for k, t in zip(keys, texts) if k not in found]
+        if missing:
+            embedded = await self.embedder.embed([t for _, t in missing])
+            for (k, _), vector in zip(missing, embedded):
+                found[k] = self._embed_cache[k] = vector
+
+        vectors = []
+        for k in keys:
+            if k in self._embed_cache:
+                self._embed_cache.move_to_end(k)
+            vectors.append(found[k])
+        while len(self._embed_cache) > self._embed_cache_size:
+            self._embed_cache.popitem(last=False)
+        return vectors
+
+    async def _simple_chat(self, message, history, on_delta=None):
+        # Basic chat. The client resends the history every turn, so a single stateless
+        # generate_content call is enough (no ChatSession object per request).
+        contents = [{"role": "user" if m['role'] == "user" else "model", "parts": [m['content']]} for m in history] if history else []
+        contents.append({"role": "user", "parts": [message]})
+        return await self._run_model(contents, on_delta=on_delta)
+
+    async def _run_model(self, contents, on_delta=None):
+        """
+        Runs the chat model through the SDK's async client and returns the text.
+        With `on_delta`, the response is streamed and every chunk is forwarded to
+        `on_delta` as soon as it arrives.
+        Rate-limit errors (429) are retried twice with a short jittered backoff (at most ~1.5s
+        in total: the user is waiting), as long as nothing has been streamed to the client yet.
+        """
+        from google.api_core.exceptions import ResourceExhausted
+        for attempt in range(3):
+            parts = []
+            try:
+                if on_delta is None:
+                    res = await self.chat_model.generate_content_async(contents)
+                    return res.text
+
+                res = await self.chat_model.generate_content_async(contents, stream=True)
+                async for chunk in res:
+                    parts.append(chunk.text)
+                    await on_delta(chunk.text)
+                return "".join(parts)
+            except ResourceExhausted:
+                if attempt == 2 or parts:
+                    raise
+                delay = random.uniform(0.25, 0.5) * 2 ** attempt
+                logger.warning("Gemini rate limited, retrying in %.2fs", delay)
+                await asyncio.sleep(delay)
 
     async def _extract_field(self, message, field_name, options):
         # Logic to extract value for a field from natural language
@@ -334,30 +640,34 @@ class AgentSystem:
         If the text contains the answer, return ONLY the value (e.g. from the 'value' field if options are provided).
         If not found, return NULL.
         """
-        res = self.chat_model.generate_content(prompt)
-        val = res.text.strip()
+        val = await self._run_model(prompt)
+        val = val.strip()
         if "NULL" in val or not val: return None
         # Basic cleanup
         return val.replace('"', '').replace("'", "")
 
-    async def _generate_decision_response(self, decision, process_type, context):
+    def _load_policy(self, path):
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except Exception as e:
+            logger.error("Error loading policy text: %s", e)
+            return ""
+
+    async def _generate_decision_response(self, decision, process_type, context, on_delta=None):
         allowed_actions = decision.get('allowed_actions', [])
         reason = decision.get('reason', '')
         desc = decision.get('decision', '')
         
         # Select Policy Text
         policy_text = ""
-        try:
-            if "STOP" in process_type:
-                with open(STOP_RULES_PATH.replace('rules_stop_reparto.json', 'policy_stop_reparto.txt'), 'r') as f:
-                    policy_text = f.read()
-            elif "URGENT" in process_type:
-                with open(URGENT_RULES_PATH.replace('rules_aviso_urgente.json', 'policy_aviso_urgente.txt'), 'r') as f:
-                    policy_text = f.read()
-        except Exception as e:
-            logger.error(f"Error loading policy text: {e}")
+        if "STOP" in process_type:
+            policy_text = self.policy_texts["STOP"]
+        elif "URGENT" in process_type:
+            policy_text = self.policy_texts["URGENT"]
+        stable_ctx = {k: context[k] for k in _STABLE_CONTEXT_KEYS if k in context}
+        dynamic_ctx = {k: v for k, v in context.items() if k not in stable_ctx}
 
-        
         prompt = f"""
         Genera una respuesta FINAL para el cliente.
         NO expliques qué regla has usado.
@@ -370,13 +680,14 @@ class AgentSystem:
         MANUAL OPERATIVO (Solo para extraer datos como plazos):
         {policy_text}
         
+        Perfil Cliente: {json.dumps(stable_ctx, sort_keys=True)}
+        
         SITUACIÓN:
         Proceso: {process_type}
         Decisión: {desc}
         Motivo Técnico: {reason}
         Acciones: {allowed_actions}
-        Usuario Contexto: {json.dumps(context)}
+        Usuario Contexto: {json.dumps(dynamic_ctx, sort_keys=True)}
         """
-        res = self.chat_model.generate_content(prompt)
-        return res.text
+        return await self._run_model(prompt, on_delta=on_delta)
 
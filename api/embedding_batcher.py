@@ -0,0 +1,66 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    """
+    Coalesces embedding requests from concurrent chats into one batched API call.
+    Texts submitted within `window_ms` of the first pending one (or until `max_batch`
+    texts are queued) are sent together and each caller gets its own vector back.
+    """
+    def __init__(self, model, task_type, window_ms=15, max_batch=32):
+        self.model = model
+        self.task_type = task_type
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = None
+        self._worker = None
+
+    async def embed(self, texts):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            # Started lazily so it always lives on the serving event loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._queue.put_nowait((text, future))
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    async def _run(self):
+        import google.generativeai as genai
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Whatever is already queued joins without waiting
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                res = await genai.embed_content_async(model=self.model, content=[t for t, _ in batch], task_type=self.task_type)
+                for (_, future), vector in zip(batch, res['embedding']):
+                    if not future.done():
+                        future.set_result(vector)
+            except Exception as e:
+                logger.error("Batched embedding failed (%d texts): %s", len(batch), e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def aclose(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
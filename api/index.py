@@ -1,545 +1,404 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, field_validator
 import os
-import json
+import base64
+import orjson
+import logging
+import gzip
+import hashlib
+from collections import OrderedDict
+import asyncio
+from contextlib import asynccontextmanager
 from typing import List, Optional, Any, Dict
-from dotenv import load_dotenv
 
-# Import our new Agent System
+# Import our new Agent System (importing it also loads .env)
 from api.agent_system import AgentSystem
+from api.sentence_buffer import SentenceBuffer, truncate_at_sentence
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+def _start_log_listener():
+    """
+    Moves the root handlers (stdout) behind a QueueHandler: records are formatted and
+    written by a background thread, so a slow stdout pipe never stalls the event loop.
+    """
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
+log_listener = _start_log_listener()
 
 # Global Agent System Instance
 agent_system = None
+# Lazy init fallback (startup warm-up failed): a burst of first requests must build it only once
+_agent_lock = asyncio.Lock()
 
-def get_agent_system():
+async def get_agent_system():
     global agent_system
-    if not agent_system:
-        agent_system = AgentSystem()
+    if agent_system is None:
+        async with _agent_lock:
+            if agent_system is None:
+                agent_system = await asyncio.to_thread(AgentSystem)
     return agent_system
 
+# Shared ElevenLabs client: pooled keep-alive HTTP/2 connections, so TTS calls
+# don't pay a TCP + TLS handshake each time
+tts_client = None
+
+def get_tts_client():
+    global tts_client
+    if tts_client is None:
+        import httpx
+        tts_client = httpx.AsyncClient(
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            headers={"xi-api-key": os.getenv("ELEVENLABS_API_KEY", ""), "Accept": "audio/mpeg"},
+        )
+    return tts_client
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the agent (SDK imports, clients, models) and open the Pinecone connection
+    # on boot, so the first request doesn't pay the init cost.
+    # Missing configuration (ValueError) fails the boot instead of every request.
+    global agent_system
+    try:
+        agent_system = await asyncio.to_thread(AgentSystem)
+        await agent_system.warm_up()
+    except ValueError:
+        raise
+    except Exception as e:
+        logger.warning("Startup warm-up failed, will retry on first request: %s", e)
+    get_tts_client()
+    yield
+    if agent_system:
+        await agent_system.aclose()
+    if tts_client:
+        await tts_client.aclose()
+    # Flush pending log records
+    log_listener.stop()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+# ASGI gzip for JSON/text bodies. Responses that already set Content-Encoding
+# (the pre-compressed home page, TTS audio) and text/event-stream are passed through untouched.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 class Message(BaseModel):
     role: str
     content: str
 
+# The client sends the last 6 messages; enforce it server-side too
+MAX_HISTORY = 6
+
 class ChatRequest(BaseModel):
     message: str
-    history: List[Message] = []
+    # Only needed to seed (or resync) a session: once the server holds the session's history,
+    # the client omits it (None) and gets a 409 if this process lost it (restart/eviction)
+    # or holds a stale copy (see session_version)
+    history: Optional[List[Message]] = None
     flow_step: Optional[str] = None
-    context: Optional[Dict[str, Any]] = {}
+    # Full context on the first turn of a session; afterwards only the changed keys
+    # (`context_delta`, None value = removed) are merged into the server-side copy
+    context: Optional[Dict[str, Any]] = None
+    context_delta: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
+    # Session version from the last final frame: a server copy at another version is stale
+    # (e.g. a serverless instance that missed turns served elsewhere) and answers 409
+    session_version: Optional[int] = None
+
+    @field_validator('history')
+    @classmethod
+    def _cap_history(cls, v):
+        return v[-MAX_HISTORY:] if v else v
+
+# Keep proxies/CDNs from caching or buffering the stream (chunks must reach the client as they're produced)
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _sse(payload: dict) -> bytes:
+    # orjson writes UTF-8 bytes directly (no ASCII escaping, no str -> bytes re-encode)
+    return b"data: " + orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS) + b"\n\n"
+
+def _history(req: ChatRequest) -> Optional[list]:
+    # None when omitted: the server-side session's history is used
+    return req.model_dump(include={"history"})["history"]
+
+async def _resync_response(req: ChatRequest):
+    """
+    409 when the client omitted its history/context but the server doesn't have the session,
+    or has it at a different version than the client's (stale copy: its context_delta base differs).
+    """
+    if req.session_id and (req.history is None or req.context is None):
+        sys = await get_agent_system()
+        if req.session_version is None or sys.sessions.version(req.session_id) != req.session_version:
+            return ORJSONResponse(status_code=409, content={"resync": True})
+    return None
+
+def _final_payload(response_data: dict) -> dict:
+    return {
+        "answer": response_data.get("answer", "No answer generated."),
+        "flow_step": response_data.get("flow_step"),
+        "sources": response_data.get("sources_data", []), 
+        "context_updates": response_data.get("context_updates", {}),
+        "source_type": response_data.get("source"),
+        "debug_info": response_data.get("debug_info")
+    }
 
 @app.post("/api/chat")
 async def chat(req: ChatRequest):
-    try:
-        sys = get_agent_system()
-        print(f"DEBUG: Processing with Context: {req.context}")
-        
-        response_data = await sys.process_request(
-            message=req.message,
-            history=[m.dict() for m in req.history],
-            context=req.context,
-            flow_step=req.flow_step
-        )
-        
-        return {
-            "answer": response_data.get("answer", "No answer generated."),
-            "flow_step": response_data.get("flow_step"),
-            "sources": response_data.get("sources_data", []), 
-            "context_updates": response_data.get("context_updates", {}),
-            "source_type": response_data.get("source"),
-            "debug_info": response_data.get("debug_info")
+    """
+    Streams the answer as Server-Sent Events:
+    - `{"delta": "..."}` frames while the LLM is generating.
+    - A last `{"final": {...}}` frame with the full answer, sources and flow_step.
+    """
+    if resync := await _resync_response(req):
+        return resync
+
+    async def events():
+        try:
+            sys = await get_agent_system()
+            logger.debug("Processing with context: %s", req.context)
+
+            async for event in sys.stream_request(
+                message=req.message,
+                history=_history(req),
+                context=req.context,
+                flow_step=req.flow_step,
+                session_id=req.session_id,
+                context_delta=req.context_delta,
+                session_version=req.session_version
+            ):
+                if "delta" in event:
+                    yield _sse(event)
+                    continue
+                final = _final_payload(event["final"])
+                if req.session_id:
+                    final["session_version"] = sys.sessions.version(req.session_id)
+
+        except Exception as e:
+            logger.exception("chat handler failed")
+            final = {"answer": f"❌ Error del Sistema: {str(e)}", "flow_step": None}
+
+        yield _sse({"final": final})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/api/voice_turn")
+async def voice_turn(req: ChatRequest):
+    """
+    Voice tab turn, streamed as Server-Sent Events:
+    - `{"audio": "<base64 pcm_24000>"}` frames, one per sentence and in order. Each sentence is
+      sent to TTS as soon as the LLM stream completes it, so the first one is already
+      playing while the rest of the answer is being generated.
+    - A last `{"final": {...}}` frame, same as /api/chat.
+    """
+    if resync := await _resync_response(req):
+        return resync
+
+    client = get_tts_client()
+    # TTS tasks in sentence order; the final payload (a dict) marks the end
+    pending = asyncio.Queue()
+
+    async def synthesize(sentence):
+        # Raw 16-bit PCM: the browser builds the AudioBuffer directly, no MP3 decode
+        request = _tts_request(sentence, output_format="pcm_24000", params={"optimize_streaming_latency": 3})
+        resp = await client.send(request)
+        resp.raise_for_status()
+        return resp.content
+
+    def speak(sentence):
+        pending.put_nowait(asyncio.create_task(synthesize(sentence)))
+
+    async def produce():
+        sentences = SentenceBuffer()
+        streamed = []
+        try:
+            sys = await get_agent_system()
+            async for event in sys.stream_request(
+                message=req.message,
+                history=_history(req),
+                context=req.context,
+                flow_step=req.flow_step,
+                session_id=req.session_id,
+                context_delta=req.context_delta,
+                session_version=req.session_version
+            ):
+                if "delta" in event:
+                    streamed.append(event["delta"])
+                    for s in sentences.push(event["delta"]):
+                        speak(s)
+                    continue
+                final = _final_payload(event["final"])
+                if req.session_id:
+                    final["session_version"] = sys.sessions.version(req.session_id)
+
+            # Answers that weren't (fully) streamed: cached answers, flow questions, appended hints
+            text, answer = "".join(streamed), final["answer"]
+            rest = answer[len(text):] if answer.startswith(text) else ("" if text else answer)
+            for s in sentences.push(rest):
+                speak(s)
+        except Exception as e:
+            logger.exception("voice turn failed")
+            final = {"answer": f"❌ Error del Sistema: {str(e)}", "flow_step": None}
+
+        tail = sentences.flush()
+        if tail:
+            speak(tail)
+        pending.put_nowait(final)
+
+    async def events():
+        producer = asyncio.create_task(produce())
+        try:
+            while not isinstance(item := await pending.get(), dict):
+                try:
+                    audio = await item
+                except Exception as e:
+                    logger.error("Voice turn TTS failed: %s", e)
+                    continue
+                yield _sse({"audio": base64.b64encode(audio).decode("ascii")})
+            yield _sse({"final": item})
+        finally:
+            producer.cancel()
+            while not pending.empty():
+                item = pending.get_nowait()
+                if isinstance(item, asyncio.Task):
+                    item.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+TTS_VOICE_ID = "7QQzpAyzlKTVrRzQJmTE" # Custom Voice
+# Turbo is several times faster than real time (low time-to-first-audio) for conversational turns;
+# the multilingual model is only used when higher quality is explicitly requested
+TTS_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_turbo_v2_5")
+TTS_HQ_MODEL_ID = os.getenv("ELEVENLABS_HQ_MODEL_ID", "eleven_multilingual_v2")
+
+def _tts_request(text: str, output_format: str = "mp3_44100_64", params: Optional[dict] = None, model_id: str = TTS_MODEL_ID):
+    # /stream starts sending audio as soon as the first part is synthesized
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{TTS_VOICE_ID}/stream"
+    data = {
+        "text": text,
+        "model_id": model_id,
+        "voice_settings": {
+            "stability": 0.5,
+            "similarity_boost": 0.75
         }
+    }
+    return get_tts_client().build_request("POST", url, params={"output_format": output_format, **(params or {})}, json=data)
 
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return {"answer": f"❌ Error del Sistema: {str(e)}", "flow_step": None}
+# Billed per character: longer texts are cut at a sentence boundary
+TTS_MAX_CHARS = 1500
+# Recently synthesized audio: blake2b(model + text) -> MP3 bytes (LRU)
+TTS_CACHE_SIZE = 64
+_tts_cache = OrderedDict()
 
 @app.post("/api/tts")
-async def text_to_speech(req: Message):
+async def text_to_speech(req: Message, hq: bool = False):
+    text = truncate_at_sentence((req.content or "").strip(), TTS_MAX_CHARS)
+    if not text:
+        return Response(status_code=204)
+
+    model_id = TTS_HQ_MODEL_ID if hq else TTS_MODEL_ID
+    key = hashlib.blake2b(f"{model_id}\n{text}".encode("utf-8"), digest_size=8).digest()
+    cached = _tts_cache.get(key)
+    if cached is not None:
+        _tts_cache.move_to_end(key)
+        return Response(content=cached, media_type="audio/mpeg", headers={"Content-Encoding": "identity"})
+
     try:
-        import httpx
-        text = req.content
-        voice_id = "7QQzpAyzlKTVrRzQJmTE" # Custom Voice
-        api_key = os.getenv("ELEVENLABS_API_KEY")
-        
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-        headers = {
-            "Accept": "audio/mpeg",
-            "Content-Type": "application/json",
-            "xi-api-key": api_key
-        }
-        data = {
-            "text": text,
-            "model_id": "eleven_multilingual_v2",
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.75
-            }
-        }
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(url, json=data, headers=headers, timeout=30.0)
-            if resp.status_code != 200:
-                print(f"ElevenLabs Error: {resp.text}")
-                return JSONResponse(status_code=500, content={"message": "TTS Error"})
-            from fastapi.responses import Response
-            return Response(content=resp.content, media_type="audio/mpeg")
+        client = get_tts_client()
+        resp = await client.send(_tts_request(text, model_id=model_id), stream=True)
+        if resp.status_code != 200:
+            await resp.aread()
+            await resp.aclose()
+            logger.error("ElevenLabs Error: %s", resp.text)
+            return ORJSONResponse(status_code=500, content={"message": "TTS Error"})
+
+        # Audio is forwarded to the browser chunk by chunk instead of buffering the whole MP3
+        async def audio():
+            chunks = []
+            try:
+                async for chunk in resp.aiter_bytes(4096):
+                    chunks.append(chunk)
+                    yield chunk
+                # Only complete audio is cached
+                _tts_cache[key] = b"".join(chunks)
+                if len(_tts_cache) > TTS_CACHE_SIZE:
+                    _tts_cache.popitem(last=False)
+            finally:
+                await resp.aclose()
+
+        # MP3 doesn't compress: the explicit encoding makes the gzip middleware pass it through
+        return StreamingResponse(audio(), media_type="audio/mpeg", headers={"Content-Encoding": "identity"})
 
     except Exception as e:
-        print(f"TTS Exception: {e}")
-        return JSONResponse(status_code=500, content={"message": str(e)})
-
-@app.get("/", response_class=HTMLResponse)
-async def home():
-    return """
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no, viewport-fit=cover">
-        <title>Aquaservice Agentic System</title>
-        <script src="https://cdn.tailwindcss.com"></script>
-        <link href="https://fonts.googleapis.com/css2?family=Outfit:wght@300;400;600;700&display=swap" rel="stylesheet">
-        <script src="https://unpkg.com/lucide@latest"></script>
-        <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
-        <style>
-            body { font-family: 'Outfit', sans-serif; height: 100dvh; overscroll-behavior: none; }
-            .scrollbar-hide::-webkit-scrollbar { display: none; }
-            .glass { background: rgba(255, 255, 255, 0.95); backdrop-filter: blur(10px); }
-            
-            .toggle-checkbox:checked { right: 0; border-color: #002E7D; }
-            .toggle-checkbox:checked + .toggle-label { background-color: #002E7D; }
-            
-            .prose p { margin-bottom: 0.5em; }
-            .prose strong { color: inherit; font-weight: 700; }
-            .prose ul { list-style-type: disc; padding-left: 1.2em; margin-bottom: 0.5em; }
-            .prose ol { list-style-type: decimal; padding-left: 1.2em; margin-bottom: 0.5em; }
-
-            /* Voice Pulse Animation */
-            .mic-wrapper {
-                position: relative;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-            }
-            .mic-button {
-                z-index: 20;
-                transition: all 0.3s ease;
-            }
-            .pulse-ring {
-                position: absolute;
-                top: 50%; left: 50%;
-                transform: translate(-50%, -50%);
-                width: 100%; height: 100%;
-                border-radius: 50%;
-                background: rgba(0, 46, 125, 0.2);
-                z-index: 10;
-                animation: ripple 1.5s infinite cubic-bezier(0.4, 0, 0.6, 1);
-            }
-            @keyframes ripple {
-                0% { transform: translate(-50%, -50%) scale(0.8); opacity: 1; }
-                100% { transform: translate(-50%, -50%) scale(1.6); opacity: 0; }
-            }
-            
-            .speaking-wave { display: flex; align-items: center; gap: 4px; height: 20px; }
-            .speaking-wave span { display: block; width: 4px; background: #002E7D; animation: wave 1s infinite ease-in-out; }
-            .speaking-wave span:nth-child(2) { animation-delay: 0.1s; }
-            .speaking-wave span:nth-child(3) { animation-delay: 0.2s; }
-            .speaking-wave span:nth-child(4) { animation-delay: 0.3s; }
-            @keyframes wave { 0%, 100% { height: 4px; } 50% { height: 20px; } }
-        </style>
-    </head>
-    <body class="bg-slate-100 flex items-center justify-center p-0 md:p-4">
-        
-        <div class="bg-white w-full h-full md:max-w-6xl md:h-[90vh] md:rounded-3xl shadow-2xl overflow-hidden flex relative">
-            
-            <!-- Context Panel -->
-            <div id="settingsPanel" class="hidden md:flex flex-col w-72 bg-slate-50 border-r border-slate-200 h-full transition-all duration-300 absolute md:relative z-20 md:z-0 transform md:transform-none -translate-x-full md:translate-x-0">
-                <!-- ... settings content ... -->
-                <div class="p-6 border-b border-slate-200 flex justify-between items-center bg-white">
-                    <h2 class="font-bold text-[#002E7D] text-lg">Contexto Cliente</h2>
-                    <button id="closeSettings" class="md:hidden text-slate-400 hover:text-red-500"><i data-lucide="x"></i></button>
-                </div>
-                <div class="flex-1 overflow-y-auto p-6 space-y-6">
-                    <form id="contextForm" class="space-y-4"></form>
-                </div>
-                <div class="p-4 border-t border-slate-200 bg-white">
-                    <button onclick="resetContext()" class="w-full py-2 text-slate-500 text-sm hover:text-[#002E7D] font-medium transition-colors">Restablecer Valores</button>
-                </div>
-            </div>
-
-            <!-- Main Content -->
-            <div class="flex-1 flex flex-col h-full relative w-full border-r border-slate-100 bg-white">
-                
-                <!-- Navbar -->
-                <!-- ... navbar code ... -->
-                <div class="bg-white/80 backdrop-blur-md px-4 pt-4 border-b border-slate-100 flex justify-between items-center shrink-0 w-full z-10">
-                    <div class="flex items-center gap-4">
-                         <button id="toggleSettings" class="md:hidden p-2 rounded-xl bg-slate-100 text-[#002E7D]"><i data-lucide="settings-2"></i></button>
-                         <div class="flex bg-slate-100 p-1 rounded-2xl">
-                             <button onclick="switchTab('chat')" id="tab-chat" class="px-4 py-2 rounded-xl text-sm font-bold transition-all bg-white text-[#002E7D] shadow-sm">Chat</button>
-                             <button onclick="switchTab('voice')" id="tab-voice" class="px-4 py-2 rounded-xl text-sm font-bold transition-all text-slate-500 hover:text-[#002E7D]">Voz (Teléfono)</button>
-                         </div>
-                    </div>
-                    <div class="flex gap-2 mb-2">
-                        <button onclick="toggleDebug()" class="p-2 text-slate-400 hover:text-[#002E7D] transition-colors" title="Toggle Logic View"><i data-lucide="cpu" size="18"></i></button>
-                        <button onclick="location.reload()" class="p-2 text-slate-400 hover:text-[#002E7D] transition-colors"><i data-lucide="rotate-ccw" size="18"></i></button>
-                    </div>
-                </div>
-
-                <!-- Chat View -->
-                <div id="view-chat" class="flex-1 flex flex-col h-full overflow-hidden">
-                    <div id="log" class="flex-1 overflow-y-auto p-4 space-y-6 bg-slate-50 scroll-smooth">
-                        <div class="flex gap-4">
-                             <div class="w-8 h-8 rounded-full bg-gradient-to-br from-[#002E7D] to-blue-600 flex items-center justify-center text-white text-xs font-bold shrink-0 mt-1">AI</div>
-                             <div class="bg-white border border-slate-100 p-4 rounded-2xl rounded-tl-none text-slate-600 text-[15px] shadow-sm max-w-[85%] leading-relaxed prose">
-                                Hola 👋 Soy tu asistente inteligente.
-                             </div>
-                        </div>
-                    </div>
-                    <div id="typing" class="hidden px-6 py-2 bg-slate-50">
-                        <div class="flex items-center gap-2 text-blue-600 text-xs font-semibold bg-blue-50 w-fit px-3 py-1.5 rounded-full">
-                            <i data-lucide="loader-2" class="animate-spin" size="12"></i><span>Procesando...</span>
-                        </div>
-                    </div>
-                    <div class="p-4 bg-white/80 backdrop-blur-md border-t border-slate-100">
-                        <div class="flex gap-2 max-w-3xl mx-auto relative">
-                            <input id="q" type="text" autocomplete="off" class="flex-1 bg-slate-100 border-0 rounded-2xl px-5 py-4 text-slate-700 outline-none text-[15px]" placeholder="Escribe tu mensaje aquí...">
-                            <button id="b" class="bg-[#002E7D] hover:bg-blue-900 text-white px-6 rounded-2xl shadow-lg transition-all flex items-center justify-center"><i data-lucide="send" size="20"></i></button>
-                        </div>
-                        <div class="text-center mt-2"><span id="activeSource" class="text-[10px] uppercase font-bold text-slate-300 tracking-wider"></span></div>
-                    </div>
-                </div>
-
-                <!-- Voice View -->
-                <div id="view-voice" class="hidden flex-1 flex flex-col items-center justify-center bg-slate-50 relative overflow-hidden">
-                    <div class="absolute inset-0 opacity-10 pointer-events-none flex items-center justify-center">
-                        <div class="w-96 h-96 bg-[#002E7D] rounded-full blur-3xl"></div>
-                    </div>
-                    <div class="z-10 text-center space-y-8 flex flex-col items-center">
-                        <div class="mb-4">
-                            <h2 class="text-2xl font-bold text-slate-800">Llamada en curso</h2>
-                            <p class="text-slate-500" id="voiceStatus">Presiona para hablar</p>
-                        </div>
-                        <div class="mic-wrapper w-32 h-32">
-                            <button id="micBtn" onclick="toggleVoice()" class="mic-button w-24 h-24 rounded-full bg-white shadow-2xl flex items-center justify-center border-4 border-white">
-                                <i id="micIcon" data-lucide="mic" class="text-slate-400 w-10 h-10"></i>
-                            </button>
-                            <div id="voiceRing" class="hidden"></div>
-                        </div>
-                        <div id="wave-container" class="h-8 flex justify-center items-center opacity-0 transition-opacity">
-                            <div class="speaking-wave"><span></span><span></span><span></span><span></span></div>
-                        </div>
-                    </div>
-                </div>
-            </div>
-
-            <!-- Debug Panel -->
-            <!-- ... -->
-            <div id="debugPanel" class="hidden md:flex flex-col w-80 bg-slate-900 border-l border-slate-800 h-full overflow-y-auto text-slate-300 font-mono text-xs">
-                 <div class="p-4 border-b border-slate-700 bg-slate-950 flex justify-between items-center sticky top-0">
-                    <h2 class="font-bold text-emerald-400 uppercase tracking-wider flex items-center gap-2"><i data-lucide="terminal" size="14"></i> Logic Trace</h2>
-                </div>
-                <div id="debugLog" class="p-4 space-y-4">
-                    <div class="text-slate-500 italic text-center mt-10">Esperando eventos...</div>
-                </div>
-            </div>
-        </div>
-
-        <div id="overlay" class="fixed inset-0 bg-black/50 z-10 hidden md:hidden glass"></div>
-
-        <script>
-            lucide.createIcons();
-            
-            // --- STATE ---
-            const defaultContext = {
-              "plan": "Ahorro",
-              "scoring": 3.5,
-              "motivo": "exceso_agua",
-              "stops_ultimo_ano": 1,
-              "albaran_descargado": false,
-              "tipo_cliente": "residencial",
-              "canal": "Chat",
-              "is_delivery_day": false,
-              "has_pending_usual_delivery": false,
-              "has_pending_crm_delivery": false,
-              "urgent_notice_allowed_zone": true,
-              "next_delivery_hours": 72,
-              "route_type": "Normal",
-              "pending_crm_hours": 24,
-              "es_puntual": false,
-              "producto": "agua",
-              "cantidad": ""
-            };
-            let userContext = {...defaultContext};
-            let flowStep = null;
-            let historyLog = [];
-            let showDebug = true;
-            let currentTab = 'chat';
-            let isRecording = false;
-            let recognition;
-            let currentAudio = null;
-            let autoListen = false;
-
-            // --- UI FUNCTIONS ---
-            function renderSettings() {
-                const form = document.getElementById('contextForm');
-                if (!form) return;
-                form.innerHTML = '';
-                Object.keys(userContext).forEach(key => {
-                    const val = userContext[key];
-                    const type = typeof val;
-                    const group = document.createElement('div');
-                    group.className = "flex flex-col gap-1.5";
-                    const label = document.createElement('label');
-                    label.className = "text-xs font-bold text-slate-500 uppercase tracking-wide";
-                    label.innerText = key.replace(/_/g, ' ');
-                    
-                    let input;
-                    if (type === 'boolean') {
-                        const wrapper = document.createElement('div');
-                        wrapper.className = "relative inline-block w-10 mr-2 align-middle select-none transition duration-200 ease-in";
-                        input = document.createElement('input');
-                        input.type = "checkbox"; input.checked = val;
-                        input.className = "toggle-checkbox absolute block w-5 h-5 rounded-full bg-white border-2 border-slate-300 appearance-none cursor-pointer transition-all duration-300";
-                        const lbl = document.createElement('label');
-                        lbl.className = "toggle-label block overflow-hidden h-5 rounded-full bg-slate-300 cursor-pointer";
-                        wrapper.appendChild(input); wrapper.appendChild(lbl);
-                        const row = document.createElement('div');
-                        row.className = "flex items-center justify-between bg-white p-2 border rounded-xl";
-                        row.appendChild(label); row.appendChild(wrapper);
-                        input.onchange = (e) => updateContext(key, e.target.checked);
-                        group.appendChild(row); form.appendChild(group); return;
-                    } 
-                    if (type === 'number') {
-                        input = document.createElement('input'); input.type = "number"; input.value = val; input.step = "0.1";
-                    } else {
-                        if (key === 'plan') {
-                             input = document.createElement('select');
-                             ['Ahorro', 'Planocho'].forEach(opt => {
-                                const o = document.createElement('option'); o.value = opt; o.text = opt; o.selected = opt === val; input.appendChild(o);
-                             });
-                        } else {
-                            input = document.createElement('input'); input.type = "text"; input.value = val;
-                        }
-                    }
-                    if (!input.className) {
-                        input.className = "w-full bg-white border border-slate-200 rounded-lg px-3 py-2 text-sm text-slate-700 outline-none";
-                        input.onchange = (e) => updateContext(key, type === 'number' ? parseFloat(e.target.value) : e.target.value);
-                    }
-                    group.appendChild(label); group.appendChild(input); form.appendChild(group);
-                });
-            }
-
-            function updateContext(key, value) { userContext[key] = value; console.log("Ctx Upd:", key, value); }
-            function resetContext() { userContext = {...defaultContext}; renderSettings(); }
-            function syncContext(updates) {
-                if (!updates) return;
-                let changed = false;
-                Object.keys(updates).forEach(k => { if (userContext[k] !== updates[k]) { userContext[k] = updates[k]; changed = true; }});
-                if (changed) renderSettings();
-            }
-
-            function addMsg(text, isUser, meta = {}) {
-                const log = document.getElementById('log');
-                const div = document.createElement('div');
-                div.className = isUser ? "flex flex-row-reverse gap-4" : "flex gap-4";
-                let sourceBadge = '';
-                if (!isUser && meta.source) {
-                    let color = 'bg-slate-200 text-slate-600';
-                    if(meta.source.includes('STOP')) color = 'bg-red-100 text-red-600';
-                    if(meta.source.includes('URGENT')) color = 'bg-amber-100 text-amber-600';
-                    if(meta.source.includes('RAG')) color = 'bg-emerald-100 text-emerald-600';
-                    sourceBadge = `<span class="text-[10px] font-bold px-2 py-0.5 rounded-md ${color} ml-2 mb-1 inline-block uppercase tracking-wider">${meta.source.replace('AGENT_', '')}</span>`;
-                }
-                div.innerHTML = `
-                    <div class="w-8 h-8 rounded-full flex items-center justify-center text-xs shrink-0 mt-1 shadow-sm ${isUser?'bg-slate-200 text-slate-600':'bg-gradient-to-br from-[#002E7D] to-blue-600 text-white font-bold'}">${isUser?'TÚ':'AI'}</div>
-                    <div class="flex flex-col ${isUser ? 'items-end' : 'items-start'} max-w-[85%]">
-                         ${sourceBadge}
-                        <div class="${isUser?'bg-[#002E7D] text-white rounded-tr-none':'bg-white border border-slate-100 text-slate-600 rounded-tl-none'} p-4 rounded-2xl text-[15px] shadow-sm leading-relaxed prose">
-                            ${isUser ? text.replace(/\\n/g, '<br>') : marked.parse(text)}
-                        </div>
-                    </div>`;
-                log.appendChild(div); log.scrollTop = log.scrollHeight;
-                historyLog.push({role: isUser ? "user" : "assistant", content: text});
-            }
-
-            async function ask() {
-                const q = document.getElementById('q'); const val = q.value.trim(); if(!val) return;
-                addMsg(val, true); q.value = '';
-                document.getElementById('typing').classList.remove('hidden');
-                try {
-                    const res = await fetch('/api/chat', {
-                        method: 'POST', headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({ message: val, history: historyLog.slice(-6), flow_step: flowStep, context: userContext })
-                    });
-                    const d = await res.json();
-                    flowStep = d.flow_step;
-                    document.getElementById('typing').classList.add('hidden');
-                    addMsg(d.answer, false, {source: d.source_type});
-                    if (d.context_updates) syncContext(d.context_updates);
-                    if (d.debug_info) addDebugTrace(d.debug_info);
-                    const srcLabel = document.getElementById('activeSource');
-                    if(srcLabel) srcLabel.innerText = "Último proceso: " + (d.source_type || "N/A");
-                } catch(e) { console.error(e); document.getElementById('typing').classList.add('hidden'); addMsg("Error de conexión.", false); }
-            }
-
-            // --- VOICE LOGIC ---
-            if ('webkitSpeechRecognition' in window) {
-                recognition = new webkitSpeechRecognition();
-                recognition.continuous = false; recognition.lang = 'es-ES'; recognition.interimResults = false;
-                
-                recognition.onstart = () => { isRecording = true; updateVoiceUI('listening'); };
-                
-                recognition.onresult = (e) => {
-                    const transcript = e.results[0][0].transcript;
-                    handleVoiceInput(transcript);
-                };
-                
-                recognition.onerror = (e) => { 
-                    console.error(e);
-                    if (e.error === 'no-speech' && autoListen) {
-                         // Keep alive retry logic
-                         setTimeout(() => { if(autoListen && !isRecording) recognition.start(); }, 500);
-                         return;
-                    }
-                    updateVoiceUI('idle'); isRecording = false; 
-                };
-                
-                recognition.onend = () => { isRecording = false; };
-            }
-
-            function switchTab(tab) {
-                currentTab = tab;
-                document.getElementById('view-chat').classList.toggle('hidden', tab !== 'chat');
-                document.getElementById('view-voice').classList.toggle('hidden', tab !== 'voice');
-                const btnChat = document.getElementById('tab-chat');
-                const btnVoice = document.getElementById('tab-voice');
-                if (tab === 'chat') {
-                    btnChat.className = "px-4 py-2 rounded-xl text-sm font-bold bg-white text-[#002E7D] shadow-sm transition-all";
-                    btnVoice.className = "px-4 py-2 rounded-xl text-sm font-bold text-slate-500 hover:text-[#002E7D] transition-all";
-                } else {
-                    btnVoice.className = "px-4 py-2 rounded-xl text-sm font-bold bg-white text-[#002E7D] shadow-sm transition-all";
-                    btnChat.className = "px-4 py-2 rounded-xl text-sm font-bold text-slate-500 hover:text-[#002E7D] transition-all";
-                }
-            }
-
-            function toggleVoice() {
-                if (!recognition) return alert("Navegador no soportado");
-                if (autoListen || isRecording) {
-                    autoListen = false;
-                    recognition.stop();
-                    if(currentAudio) { currentAudio.pause(); currentAudio = null; }
-                    updateVoiceUI('idle');
-                } else {
-                    autoListen = true;
-                    if(currentAudio) { currentAudio.pause(); currentAudio = null; } 
-                    try { recognition.start(); } catch(e) { console.error(e); }
-                }
-            }
-
-            function updateVoiceUI(state) {
-                const ring = document.getElementById('voiceRing'); 
-                const micIcon = document.getElementById('micIcon');
-                const status = document.getElementById('voiceStatus'); 
-                const wave = document.getElementById('wave-container');
-                const micBtn = document.getElementById('micBtn');
-                
-                ring.className = "hidden";
-                micBtn.className = "mic-button w-24 h-24 rounded-full bg-white shadow-2xl flex items-center justify-center border-4 border-white";
-                micIcon.className = "w-10 h-10 text-slate-400";
-                wave.classList.remove('opacity-100'); wave.classList.add('opacity-0');
-
-                if (state === 'listening') {
-                    status.innerText = "Escuchando..."; 
-                    micBtn.className = "mic-button w-24 h-24 rounded-full bg-red-500 shadow-xl flex items-center justify-center border-4 border-red-100";
-                    micIcon.className = "w-10 h-10 text-white";
-                    ring.className = "pulse-ring"; 
-                } else if (state === 'processing') {
-                    status.innerText = "Pensando..."; 
-                    micIcon.className = "w-10 h-10 text-slate-400 animate-pulse";
-                } else if (state === 'speaking') {
-                    status.innerText = "Pablo hablando..."; 
-                    micBtn.className = "mic-button w-24 h-24 rounded-full bg-[#002E7D] shadow-xl flex items-center justify-center border-4 border-blue-100";
-                    micIcon.className = "w-10 h-10 text-white";
-                    wave.classList.remove('opacity-0'); wave.classList.add('opacity-100');
-                } else {
-                    status.innerText = "Presiona para hablar";
-                }
-                lucide.createIcons();
-            }
-
-            async function handleVoiceInput(text) {
-                updateVoiceUI('processing');
-                try {
-                     const res = await fetch('/api/chat', {
-                        method: 'POST', headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({ message: text, history: historyLog.slice(-6), flow_step: flowStep, context: userContext })
-                    });
-                    const d = await res.json();
-                    flowStep = d.flow_step;
-                    if (d.context_updates) syncContext(d.context_updates);
-                    if (d.debug_info) addDebugTrace(d.debug_info);
-                    addDebugTrace({user_voice: text, assistant_text: d.answer});
-                    historyLog.push({role: "user", content: text}); historyLog.push({role: "assistant", content: d.answer});
-
-                    const ttsRes = await fetch('/api/tts', {
-                        method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({ role: 'assistant', content: d.answer })
-                    });
-                    if (ttsRes.ok) {
-                        const blob = await ttsRes.blob(); 
-                        const url = URL.createObjectURL(blob);
-                        currentAudio = new Audio(url);
-                        currentAudio.onplay = () => updateVoiceUI('speaking');
-                        currentAudio.onended = () => {
-                            if (autoListen) {
-                                updateVoiceUI('listening');
-                                try { recognition.start(); } catch(e) { setTimeout(() => { if(autoListen) recognition.start(); }, 200); }
-                            } else { updateVoiceUI('idle'); }
-                        };
-                        currentAudio.play();
-                    } else { 
-                        updateVoiceUI('idle'); autoListen = false;
-                    }
-                } catch (e) { updateVoiceUI('idle'); autoListen = false; }
-            }
-
-            function toggleDebug() {
-                const p = document.getElementById('debugPanel'); p.classList.toggle('hidden'); p.classList.toggle('flex');
-            }
-            function addDebugTrace(data) {
-                if (!data) return;
-                const container = document.getElementById('debugLog');
-                if (container.children.length === 1 && container.children[0].classList.contains('text-slate-500')) container.innerHTML = '';
-                const entry = document.createElement('div');
-                entry.className = "bg-slate-800/50 rounded-lg p-3 border border-slate-700/50 break-words mb-2";
-                const time = new Date().toLocaleTimeString();
-                let content = `<div class="text-[10px] text-slate-500 mb-1 flex justify-between"><span>EVENT</span><span>${time}</span></div>`;
-                for (const [key, val] of Object.entries(data)) {
-                    if (key === 'context_updates') continue;
-                    let displayVal = val; if (typeof val === 'object') displayVal = JSON.stringify(val, null, 2);
-                    content += `<div class="mb-1"><span class="text-slate-500 uppercase text-[10px] font-bold block">${key}</span><span class="text-slate-300 whitespace-pre-wrap">${displayVal}</span></div>`;
-                }
-                entry.innerHTML = content; container.insertBefore(entry, container.firstChild);
-            }
-
-            document.getElementById('b').onclick = ask;
-            document.getElementById('q').onkeypress = (e) => { if(e.key === 'Enter') ask(); };
-            const panel = document.getElementById('settingsPanel'); const overlay = document.getElementById('overlay');
-            const toggleBtn = document.getElementById('toggleSettings'); const closeBtn = document.getElementById('closeSettings');
-            function togglePanel() { panel.classList.toggle('-translate-x-full'); panel.classList.toggle('absolute'); overlay.classList.toggle('hidden'); }
-            toggleBtn.onclick = togglePanel; closeBtn.onclick = togglePanel; overlay.onclick = togglePanel;
-
-            renderSettings();
-        </script>
-    </body>
-    </html>
-    """
+        logger.exception("TTS request failed")
+        return ORJSONResponse(status_code=500, content={"message": str(e)})
+
+# Home page: static file read and compressed once per process. Brotli (smaller than
+# gzip on HTML) is added when the module is installed; clients without it get gzip.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+with open(os.path.join(STATIC_DIR, "index.html"), "rb") as f:
+    HOME_HTML = f.read()
+_home_digest = hashlib.md5(HOME_HTML).hexdigest()
+
+def _home_variant(body: bytes, etag_suffix: str, encoding: Optional[str] = None):
+    # One ETag per representation, so revalidation never mixes them up.
+    # Full header sets (including Content-Length) are built once too.
+    not_modified = {
+        "Cache-Control": "public, max-age=3600",
+        "Vary": "Accept-Encoding",
+        "ETag": f'"{_home_digest}{etag_suffix}"',
+    }
+    headers = {**not_modified, "Content-Length": str(len(body))}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return body, headers, not_modified
+
+# Preferred encoding first
+HOME_VARIANTS = [("gzip", _home_variant(gzip.compress(HOME_HTML, compresslevel=9), "-gz", "gzip"))]
+if brotli:
+    HOME_VARIANTS.insert(0, ("br", _home_variant(brotli.compress(HOME_HTML, quality=11), "-br", "br")))
+HOME_IDENTITY = _home_variant(HOME_HTML, "")
+
+def _accepts(accept_encoding: str, encoding: str) -> bool:
+    # "gzip;q=0" explicitly refuses gzip, so a plain substring check isn't enough.
+    # An explicit coding takes precedence over "*" (RFC 9110), wherever each appears.
+    wildcard = False
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if coding in (encoding, "*"):
+            q = params.strip()
+            accepted = not (q.startswith("q=") and q[2:].strip("0.") == "")
+            if coding == encoding:
+                return accepted
+            wildcard = accepted
+    return wildcard
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+@app.get("/")
+async def home(request: Request):
+    accept = request.headers.get("accept-encoding", "")
+    body, headers, not_modified = next((v for coding, v in HOME_VARIANTS if _accepts(accept, coding)), HOME_IDENTITY)
+    if _etag_matches(request.headers.get("if-none-match", ""), not_modified["ETag"]):
+        return Response(status_code=304, headers=not_modified)
+    return Response(content=body, media_type="text/html", headers=headers)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("api.index:app", host="0.0.0.0", port=8000, workers=int(os.getenv("WEB_CONCURRENCY", "1")))
@@ -1,67 +1,243 @@
-import json
+import os
+import re
+import orjson
 import logging
+from functools import lru_cache
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # Optional: without it the range prefilter is pure numpy
+    njit = None
 
 logger = logging.getLogger(__name__)
 
+# First number in a string (e.g. "3 botellas" -> 3.0)
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+@lru_cache(maxsize=32)
+def _load_rules(path, mtime_ns):
+    """Parsed file + rules sorted by priority. Keyed on mtime too, so an edited file is reloaded."""
+    with open(path, 'rb') as f:
+        data = orjson.loads(f.read())
+    rules = sorted(data.get('rules', []), key=lambda x: x.get('priority', 0), reverse=True)
+    return data, rules
+
+# Rule packs with fewer range rules than this are walked in plain Python (numpy overhead dominates)
+_VECTORIZE_MIN_RULES = 64
+
+def _first_in_range(start, has, bounded, mins, maxs, present, nums):
+    """Index of the first rule >= `start` whose range conditions all hold, or -1."""
+    for i in range(start, has.shape[0]):
+        ok = True
+        for j in range(has.shape[1]):
+            if has[i, j] and not (present[j] and (not bounded[i, j] or (mins[i, j] <= nums[j] and nums[j] <= maxs[i, j]))):
+                ok = False
+                break
+        if ok:
+            return i
+    return -1
+
+if njit is not None:
+    # Compiled once and cached on disk; scans stop at the first passing rule
+    _first_in_range = njit(cache=True)(_first_in_range)
+
+# Marks a rule that doesn't pin the dispatch field to a single value
+_UNPINNED = object()
+
+def _exact_check(field, expected):
+    def check(context):
+        value = context.get(field)
+        return value is not None and value == expected
+    return check
+
+def _range_check(field, lo, hi, to_number):
+    # lo/hi are None when the condition has no min/max
+    def check(context):
+        value = context.get(field)
+        if value is None:
+            return False
+        if lo is None and hi is None:
+            return True
+        num = to_number(value)
+        return num is not None and (lo is None or num >= lo) and (hi is None or num <= hi)
+    return check
+
+class _Rule:
+    """A loaded rule with its fields unpacked once: slot reads instead of dict lookups per evaluation."""
+    __slots__ = ('id', 'when', 'then', 'matches')
+
+    def __init__(self, rule, matches):
+        self.id = rule.get('id')
+        self.when = rule.get('when', {})
+        self.then = rule.get('then')
+        self.matches = matches
+
 class RuleEngine:
     def __init__(self, rules_file_path):
-        with open(rules_file_path, 'r') as f:
-            self.data = json.load(f)
-        self.rules = sorted(self.data.get('rules', []), key=lambda x: x.get('priority', 0), reverse=True)
+        # Shared (read-only) between engines built from the same unchanged file
+        self.data, self.rules = _load_rules(rules_file_path, os.stat(rules_file_path).st_mtime_ns)
         self.process_name = self.data.get('process')
+        # Each rule's `when` block is compiled once into a predicate over the context
+        self._compiled = [_Rule(rule, self._compile(rule.get('when', {}))) for rule in self.rules]
+        self._dispatch_field, self._buckets, self._wildcard = self._build_index()
+        self._ranges = self._build_range_arrays()
 
     def evaluate(self, context: dict):
         """
         Evaluates the context against the loaded rules.
         Returns the 'then' block of the first matching rule (highest priority).
         """
-        logger.info(f"Evaluating rules for {self.process_name} with context: {context}")
+        logger.debug("Evaluating rules for %s with context: %s", self.process_name, context)
         
-        for rule in self.rules:
-            if self._matches(rule.get('when', {}), context):
-                logger.info(f"Rule matched: {rule.get('id')}")
-                return rule.get('then')
+        candidates = self._compiled
+        if self._ranges is not None:
+            # Large packs: one vectorized pass discards every rule whose ranges fail
+            candidates = self._range_candidates(context)
+        elif self._dispatch_field is not None:
+            try:
+                candidates = self._buckets.get(context.get(self._dispatch_field), self._wildcard)
+            except TypeError:
+                # Unhashable value: it can't equal any of the indexed values
+                candidates = self._wildcard
+
+        for rule in candidates:
+            if rule.matches(context):
+                logger.info("Rule matched: %s", rule.id)
+                return rule.then
         
         return None
 
-    def _matches(self, conditions, context):
-        for field, condition in conditions.items():
+    def _build_index(self):
+        """
+        Picks the field that the most rules pin to an exact scalar value and groups the rules
+        by that value. Each bucket also holds the rules that don't pin the field (in priority
+        order), so evaluate() only walks the candidates for the context's value.
+        Returns (None, None, all rules) when no field is pinned by at least two rules.
+        """
+        def pinned_value(rule, field):
+            cond = rule.when.get(field)
+            return cond if isinstance(cond, (str, int, float, bool)) else _UNPINNED
+
+        values = {}
+        for rule in self._compiled:
+            for field in rule.when:
+                if pinned_value(rule, field) is not _UNPINNED:
+                    values.setdefault(field, []).append(pinned_value(rule, field))
+        if not values:
+            return None, None, self._compiled
+        field = max(values, key=lambda f: (len(values[f]), len(set(values[f]))))
+        if len(values[field]) < 2:
+            return None, None, self._compiled
+
+        wildcard = [r for r in self._compiled if pinned_value(r, field) is _UNPINNED]
+        buckets = {
+            value: [r for r in self._compiled if pinned_value(r, field) in (_UNPINNED, value)]
+            for value in set(values[field])
+        }
+        return field, buckets, wildcard
+
+    def _build_range_arrays(self):
+        """
+        Structure-of-arrays view of the rules' numeric (min/max) conditions: row i is rule i
+        (priority order), column j is the j-th field used in a range. Missing bounds are +-inf.
+        Returns None when the pack has fewer than _VECTORIZE_MIN_RULES range rules.
+        """
+        fields = {}
+        range_rules = 0
+        for rule in self._compiled:
+            ranged = [f for f, cond in rule.when.items() if isinstance(cond, dict)]
+            range_rules += bool(ranged)
+            for field in ranged:
+                fields.setdefault(field, len(fields))
+        if range_rules < _VECTORIZE_MIN_RULES:
+            return None
+
+        shape = (len(self.rules), len(fields))
+        has = np.zeros(shape, dtype=bool)       # rule has a range on this field
+        bounded = np.zeros(shape, dtype=bool)   # ... with at least one bound (else presence only)
+        mins = np.full(shape, -np.inf)
+        maxs = np.full(shape, np.inf)
+        for i, rule in enumerate(self._compiled):
+            for field, cond in rule.when.items():
+                if not isinstance(cond, dict):
+                    continue
+                j = fields[field]
+                lo, hi = cond.get('min'), cond.get('max')
+                has[i, j] = True
+                bounded[i, j] = lo is not None or hi is not None
+                if lo is not None:
+                    mins[i, j] = lo
+                if hi is not None:
+                    maxs[i, j] = hi
+        return list(fields), has, bounded, mins, maxs
+
+    def _range_candidates(self, context):
+        """
+        Yields, in priority order, the compiled rules whose range conditions all hold for
+        `context`. Necessary but not sufficient: exact conditions are still checked per rule.
+        """
+        fields, has, bounded, mins, maxs = self._ranges
+        present, nums = self._range_values(context, fields)
+        if njit is None:
+            in_range = (mins <= nums) & (nums <= maxs)
+            mask = (~has | (present & (~bounded | in_range))).all(axis=1)
+            for i in np.flatnonzero(mask):
+                yield self._compiled[i]
+            return
+        i = _first_in_range(0, has, bounded, mins, maxs, present, nums)
+        while i >= 0:
+            yield self._compiled[i]
+            i = _first_in_range(i + 1, has, bounded, mins, maxs, present, nums)
+
+    def _range_values(self, context, fields):
+        """Per range field: whether the context has a value, and that value as a number."""
+        present = np.zeros(len(fields), dtype=bool)
+        nums = np.full(len(fields), np.nan)   # NaN (non-numeric) fails every bound comparison
+        for j, field in enumerate(fields):
             value = context.get(field)
-            
-            # If value is missing in context, we assume it doesn't match if a condition is required
-            if value is None:
-                return False
+            if value is not None:
+                present[j] = True
+                num = self._to_number(value)
+                if num is not None:
+                    nums[j] = num
+        return present, nums
 
+    def _compile(self, conditions):
+        """
+        Builds a single predicate for a rule's conditions. A field missing from the context
+        never matches; dict conditions are numeric ranges (min/max), anything else is an exact match.
+        """
+        checks = []
+        for field, condition in conditions.items():
             if isinstance(condition, dict):
-                # Handle operators like min, max
-                val_num = self._to_number(value)
-                
-                if 'min' in condition:
-                    if val_num is None or not (val_num >= condition['min']):
-                        return False
-                if 'max' in condition:
-                    if val_num is None or not (val_num <= condition['max']):
-                        return False
+                checks.append(_range_check(field, condition.get('min'), condition.get('max'), self._to_number))
             else:
-                # Exact match
-                if value != condition:
+                checks.append(_exact_check(field, condition))
+
+        def matches(context):
+            for check in checks:
+                if not check(context):
                     return False
-        return True
+            return True
+        return matches
 
     def _to_number(self, val):
         """Attempts to convert a value to a float for comparison."""
-        if isinstance(val, (int, float)):
+        t = type(val)
+        # Exact-type checks first: the common cases skip isinstance and the regex
+        if t is int or t is float or t is bool:
             return val
-        if isinstance(val, str):
-            import re
+        if t is str:
+            if val.isdecimal():
+                return float(val)
             # Try to find a number in the string (e.g. "3 botellas" -> 3.0)
             # This is simple; won't handle "tres" but handles mixed strings
-            match = re.search(r'(-?\d+(\.\d+)?)', val)
-            if match:
-                try:
-                    return float(match.group(1))
-                except:
-                    pass
+            # The pattern only matches valid float literals, so float() can't fail
+            match = _NUMBER_RE.search(val)
+            return float(match.group(0)) if match else None
+        if isinstance(val, (int, float)):
+            return val
         return None
 
     def get_missing_info(self, context):
@@ -69,15 +245,16 @@ class RuleEngine:
         Checks which required fields are missing from the context.
         """
         required = self.data.get('required_fields', [])
-        missing = [field for field in required if field not in context or context[field] is None or context[field] == ""]
+        # Only the first missing field is asked for; 0/False are valid answers, so not `not value`
+        missing = next((field for field in required if context.get(field) in (None, "")), None)
         
-        if missing:
+        if missing is not None:
             behavior = self.data.get('missing_info_behavior', {})
-            question_def = behavior.get('questions', {}).get(missing[0])
+            question_def = behavior.get('questions', {}).get(missing)
             return {
                 "status": "NEED_INFO",
-                "missing_field": missing[0],
-                "question": question_def.get('question') if question_def else f"Please provide {missing[0]}",
+                "missing_field": missing,
+                "question": question_def.get('question') if question_def else f"Please provide {missing}",
                 "options": question_def.get('options') if question_def else None
             }
         return None
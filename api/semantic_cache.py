@@ -0,0 +1,97 @@
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def quantize(vector):
+    """
+    Quantizes an embedding to int8 (4x smaller than float32) with a per-vector scale:
+    the largest component maps to +-127, so the whole int8 range is used. Scaling
+    doesn't change the direction, so cosine similarity is preserved.
+    """
+    v = np.asarray(vector, dtype=np.float32)
+    peak = np.abs(v).max() if v.size else 0
+    if peak:
+        v = v * (127 / peak)
+    return np.round(v).clip(-127, 127).astype(np.int8)
+
+def _norm(q):
+    return float(np.linalg.norm(q.astype(np.float32))) or 1.0
+
+class SemanticCache:
+    """
+    In-process cache of RAG responses keyed by the quantized query embedding.
+    - Exact hit: same int8 bytes (`q.tobytes()`).
+    - Near-duplicate hit: cosine >= `threshold`, computed for all entries at once as a
+      single int8 matrix-vector product scaled by the precomputed inverse row norms.
+    Bounded to `max_entries`: storage is preallocated (C-contiguous) on the first insert
+    and the least recently used slot is overwritten in place once full.
+    With `ttl` (seconds), entries older than that are misses (the knowledge base behind
+    the cached answers is re-synced periodically).
+    """
+    def __init__(self, max_entries=1000, threshold=0.95, ttl=None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._index = {}         # q.tobytes() -> slot
+        self._keys = []          # slot -> q.tobytes()
+        self._values = []        # slot -> cached response
+        self._matrix = None      # (max_entries, dim) int8, one quantized embedding per slot
+        self._inv_norms = None   # slot -> 1 / L2 norm of the int8 row
+        self._last_used = np.zeros(max_entries, dtype=np.int64)  # slot -> tick of last hit/insert (LRU)
+        self._expires = np.full(max_entries, np.inf)             # slot -> monotonic expiry time
+        self._tick = 0
+
+    def get(self, q):
+        now = time.monotonic()
+        row = self._index.get(q.tobytes())
+        if row is not None and self._expires[row] <= now:
+            row = None
+        n = len(self._keys)
+        if row is None and n:
+            # int8 @ int32 accumulates in int32 (no overflow); only the filled slots are scanned
+            sims = (self._matrix[:n] @ q.astype(np.int32)) * self._inv_norms[:n]
+            if self.ttl is not None:
+                sims[self._expires[:n] <= now] = -np.inf
+            best = int(np.argmax(sims))
+            sim = sims[best] / _norm(q)
+            if sim >= self.threshold:
+                logger.info("Semantic cache hit (sim=%.3f)", sim)
+                row = best
+        if row is None:
+            return None
+        self._tick += 1
+        self._last_used[row] = self._tick
+        return self._values[row]
+
+    def put(self, q, value):
+        key = q.tobytes()
+        self._tick += 1
+        row = self._index.get(key)
+        expires = time.monotonic() + self.ttl if self.ttl is not None else np.inf
+        if row is not None:
+            self._values[row] = value
+            self._last_used[row] = self._tick
+            self._expires[row] = expires
+            return
+
+        if self._matrix is None:
+            self._matrix = np.zeros((self.max_entries, q.shape[0]), dtype=np.int8)
+            self._inv_norms = np.zeros(self.max_entries, dtype=np.float32)
+
+        if len(self._keys) < self.max_entries:
+            row = len(self._keys)
+            self._keys.append(key)
+            self._values.append(value)
+        else:
+            row = int(np.argmin(self._last_used))
+            del self._index[self._keys[row]]
+            self._keys[row] = key
+            self._values[row] = value
+
+        self._index[key] = row
+        self._matrix[row] = q
+        self._inv_norms[row] = 1 / _norm(q)
+        self._last_used[row] = self._tick
+        self._expires[row] = expires
@@ -0,0 +1,62 @@
+import re
+
+# End of sentence: terminal punctuation (plus closing quotes/brackets) followed by whitespace
+_SENTENCE_END_RE = re.compile(r'[.!?…]+["\')»]*\s+')
+# Abbreviations whose trailing dot doesn't end a sentence
+_ABBREVIATIONS = frozenset({"sr", "sra", "srta", "dr", "dra", "d", "dña", "ud", "uds", "etc", "ej", "núm", "nº", "aprox", "tel", "pág"})
+
+def truncate_at_sentence(text, limit):
+    """Cuts `text` to at most `limit` chars, at the last sentence end (or word) before the limit."""
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    end = None
+    for m in _SENTENCE_END_RE.finditer(head + " "):
+        end = m.end()
+    if end is None:
+        end = head.rfind(" ")
+    return head[:end].strip() if end and end > 0 else head
+
+class SentenceBuffer:
+    """
+    Accumulates streamed LLM text and releases it sentence by sentence, so each
+    sentence can go to TTS while the rest of the answer is still being generated.
+    Sentences shorter than `min_len` are merged with the next one (avoids tiny TTS calls).
+    """
+    def __init__(self, min_len=10):
+        self.min_len = min_len
+        self._buf = ""
+        self._scan = 0   # Everything before this index has already been scanned for sentence ends
+
+    def push(self, text):
+        """Adds a chunk of text and returns the complete sentences it closed (possibly none)."""
+        self._buf += text
+        sentences = []
+        start = 0
+        for m in _SENTENCE_END_RE.finditer(self._buf, self._scan):
+            end = m.end()
+            candidate = self._buf[start:end].strip()
+            if len(candidate) < self.min_len or self._is_abbreviation(m.start()):
+                continue
+            sentences.append(candidate)
+            start = end
+        self._buf = self._buf[start:]
+        # Next push only scans the new text, plus a trailing punctuation run that may still
+        # become a sentence end when its whitespace arrives (O(new text) per chunk)
+        self._scan = len(self._buf.rstrip('"\')»').rstrip('.!?…'))
+        return sentences
+
+    def flush(self):
+        """Returns whatever is left once the stream has ended."""
+        rest, self._buf, self._scan = self._buf.strip(), "", 0
+        return rest or None
+
+    def _is_abbreviation(self, dot_index):
+        if self._buf[dot_index] != '.':
+            return False
+        word_start = max(self._buf.rfind(c, 0, dot_index) for c in ' \n\t') + 1
+        word = self._buf[word_start:dot_index].lower()
+        if not word:
+            return False
+        # "3." inside "3.5" never reaches here (no whitespace after the dot); single letters are initials
+        return word in _ABBREVIATIONS or (len(word) == 1 and word.isalpha())
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+
+class SessionStore:
+    """
+    Bounded in-process store of conversation turns and user context per client session.
+    Each session keeps between `max_turns` and 2x`max_turns` messages ({"role", "content"}):
+    old turns are dropped in blocks rather than one per turn, so the start of the history
+    (the prompt prefix) stays byte-identical across several turns.
+    The least recently used session is evicted once `max_sessions` is exceeded.
+    Each session carries a version, bumped by every recorded turn: with several processes
+    (serverless instances) serving one client, a copy whose version differs from the one
+    the client last got is stale and must be resynced.
+    """
+    def __init__(self, max_sessions=1000, max_turns=6):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self._sessions = OrderedDict()
+
+    def has(self, session_id):
+        return session_id in self._sessions
+
+    def version(self, session_id):
+        """The session's version, or None if this process doesn't hold it."""
+        session = self._sessions.get(session_id)
+        return session["version"] if session is not None else None
+
+    def open(self, session_id, client_history, client_context=None, context_delta=None, client_version=None):
+        """
+        Returns the session's (turns, context), creating the session if new.
+        - `client_history` (None when the client omitted it) seeds a new session and, for an
+          existing one, replaces its turns: the client only resends it to resync a stale copy.
+        - A full `client_context` replaces the stored one; otherwise `context_delta` is
+          merged into it (a None value removes the key). The returned dict is the stored
+          one, so updates the agent makes to it persist for the next turns.
+        - A full `client_context` (sent along with the history) resyncs the session to the
+          client's `client_version`.
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = {"turns": list((client_history or [])[-self.max_turns:]), "context": {}, "version": 0}
+            self._sessions[session_id] = session
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+            if client_history is not None:
+                session["turns"][:] = client_history[-self.max_turns:]
+
+        context = session["context"]
+        if client_context is not None:
+            context.clear()
+            context.update(client_context)
+            session["version"] = client_version or 0
+        for k, v in (context_delta or {}).items():
+            if v is None:
+                context.pop(k, None)
+            else:
+                context[k] = v
+        return session["turns"], context
+
+    def record(self, session_id, message, answer, context_updates=None):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+        session["version"] += 1
+        turns = session["turns"]
+        turns.append({"role": "user", "content": message})
+        turns.append({"role": "assistant", "content": answer})
+        if len(turns) > 2 * self.max_turns:
+            del turns[:-self.max_turns]
+        if context_updates and context_updates is not session["context"]:
+            session["context"].update(context_updates)
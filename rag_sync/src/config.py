@@ -21,6 +21,8 @@ class Config:
     PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
     PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
     PINECONE_NAMESPACE = os.getenv("PINECONE_NAMESPACE", "default")  # Good for multitenancy
+    PINECONE_UPSERT_BATCH = int(os.getenv("PINECONE_UPSERT_BATCH", "200"))
+    PINECONE_POOL_THREADS = int(os.getenv("PINECONE_POOL_THREADS", "8"))  # Concurrent async_req upserts
 
     # Gemini
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -31,9 +33,22 @@ class Config:
     # ~3000 chars is roughly 600-800 tokens.
     CHUNK_SIZE = 3000
     CHUNK_OVERLAP = 400
+    # Parallel Drive downloads (I/O bound)
+    DRIVE_DOWNLOAD_WORKERS = int(os.getenv("DRIVE_DOWNLOAD_WORKERS", "8"))
+    # Parallel chunking + embedding + upsert (also used for Salesforce articles)
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+    # Chunks from several files are embedded together, one API call per batch
+    EMBED_BATCH_CHUNKS = int(os.getenv("EMBED_BATCH_CHUNKS", "256"))
     
     # State
     STATE_FILE_PATH = os.getenv("STATE_FILE_PATH", "sync_state.json")
+    # Persistent chunk text -> embedding cache (SQLite), next to the state file; empty disables it
+    EMBED_CACHE_PATH = os.getenv(
+        "EMBED_CACHE_PATH", os.path.join(os.path.dirname(STATE_FILE_PATH), "chunk_cache.db")
+    )
+    # Change detection: "hash" = modified time changed AND content hash differs (default),
+    # "mtime" = any modified-time change re-embeds, "always" = re-embed everything every run
+    DELTA_STRATEGY = os.getenv("DELTA_STRATEGY", "hash").lower()
 
     # Salesforce
     SF_USERNAME = os.getenv("SF_USERNAME")
@@ -43,8 +58,13 @@ class Config:
     SF_CLIENT_SECRET = os.getenv("SF_CLIENT_SECRET")
     SF_DOMAIN = os.getenv("SF_DOMAIN", "login") # 'test' para sandbox
 
+    _validated = False
+
     @classmethod
     def validate(cls):
+        # The environment doesn't change within a process: a successful check is final
+        if cls._validated:
+            return
         required = [
             "PINECONE_API_KEY", "PINECONE_INDEX_NAME", 
             "GOOGLE_API_KEY", "GOOGLE_DRIVE_FOLDER_ID"
@@ -56,3 +76,6 @@ class Config:
         missing = [key for key in required if not getattr(cls, key) and not os.getenv(key)]
         if missing:
             raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
+        if cls.DELTA_STRATEGY not in ("hash", "mtime", "always"):
+            raise ValueError(f"Invalid DELTA_STRATEGY '{cls.DELTA_STRATEGY}' (expected hash, mtime or always)")
+        cls._validated = True
@@ -1,5 +1,7 @@
 import io
 import logging
+import threading
+import zipfile
 from typing import List, Dict, Any, Optional
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
@@ -11,6 +13,65 @@ from .config import Config
 logger = logging.getLogger("rag_sync.drive")
 
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
+# Download chunk size: the 100KB default costs one HTTPS round-trip per 100KB
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# PDFium is not thread-safe; downloads are parsed from a thread pool
+_PDFIUM_LOCK = threading.Lock()
+
+def _extract_pdf_text(fh) -> str:
+    """Extracts PDF text with PDFium (C++) via pypdfium2, or pure-Python pypdf if not installed."""
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        import pypdf
+        reader = pypdf.PdfReader(fh)
+        return '\n'.join(page.extract_text() or "" for page in reader.pages)
+
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(fh)
+        try:
+            return '\n'.join(page.get_textpage().get_text_range() for page in pdf)
+        finally:
+            pdf.close()
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+# Run content that contributes to a paragraph's text (same mapping as python-docx's Run.text);
+# w:br only counts as a line break (page/column breaks add nothing)
+_DOCX_TEXT = {_W + 't': None, _W + 'tab': '\t', _W + 'cr': '\n'}
+
+def _run_text(run) -> str:
+    parts = []
+    for el in run:
+        if el.tag in _DOCX_TEXT:
+            parts.append(_DOCX_TEXT[el.tag] or el.text or '')
+        elif el.tag == _W + 'br' and el.get(_W + 'type') in (None, 'textWrapping'):
+            parts.append('\n')
+    return ''.join(parts)
+
+def _extract_docx_text(fh) -> str:
+    """
+    Text of the document's top-level paragraphs (what python-docx's doc.paragraphs returns),
+    read straight from word/document.xml with lxml instead of building python-docx's object graph.
+    """
+    from lxml import etree
+    with zipfile.ZipFile(fh) as zf, zf.open('word/document.xml') as xml:
+        root = etree.parse(xml, etree.XMLParser(resolve_entities=False, huge_tree=True)).getroot()
+    body = root.find(_W + 'body')
+    if body is None:
+        return ''
+    paragraphs = []
+    for p in body.findall(_W + 'p'):
+        # Only runs directly in the paragraph or in its hyperlinks: text boxes (w:drawing/.../w:txbxContent)
+        # and mc:AlternateContent branches are nested deeper and aren't part of Paragraph.text
+        parts = []
+        for child in p:
+            if child.tag == _W + 'r':
+                parts.append(_run_text(child))
+            elif child.tag == _W + 'hyperlink':
+                parts.extend(_run_text(r) for r in child.iterfind(_W + 'r'))
+        paragraphs.append(''.join(parts))
+    return '\n'.join(paragraphs)
 
 class DriveConnector:
     def __init__(self, service_account_file: str):
@@ -18,11 +79,20 @@ class DriveConnector:
             self.creds = service_account.Credentials.from_service_account_file(
                 service_account_file, scopes=SCOPES
             )
-            self.service = build('drive', 'v3', credentials=self.creds)
+            self._local = threading.local()
+            self._local.service = build('drive', 'v3', credentials=self.creds)
         except Exception as e:
             logger.error(f"Failed to initialize Drive client: {e}")
             raise
 
+    @property
+    def service(self):
+        # The discovery client (httplib2 underneath) is not thread-safe: one per thread
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = build('drive', 'v3', credentials=self.creds)
+        return service
+
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     def list_files_in_folder(self, folder_id: str) -> List[Dict[str, Any]]:
         """
@@ -67,38 +137,33 @@ class DriveConnector:
         - PDF (application/pdf)
         """
         try:
-            content_bytes = None
-            
             # 1. Google Native Docs -> Export
             if mime_type == 'application/vnd.google-apps.document':
                 request = self.service.files().export_media(fileId=file_id, mimeType='text/plain')
                 fh = io.BytesIO()
-                downloader = MediaIoBaseDownload(fh, request)
+                downloader = MediaIoBaseDownload(fh, request, chunksize=DOWNLOAD_CHUNK_SIZE)
                 done = False
-                while done is False:
+                while not done:
                     _, done = downloader.next_chunk()
-                return fh.getvalue().decode('utf-8')
+                # Decoded straight from the buffer (no intermediate bytes copy)
+                return str(fh.getbuffer(), 'utf-8')
 
             # 2. Binary Downloads (Word, PDF, Text)
             request = self.service.files().get_media(fileId=file_id)
             fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
+            downloader = MediaIoBaseDownload(fh, request, chunksize=DOWNLOAD_CHUNK_SIZE)
             done = False
-            while done is False:
+            while not done:
                 _, done = downloader.next_chunk()
-            content_bytes = fh.getvalue()
+            # Parsers read the download buffer itself (rewound), not a copy of it
+            fh.seek(0)
 
             # 3. Parse based on Type
             if mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
                 try:
-                    import docx
-                    doc = docx.Document(io.BytesIO(content_bytes))
-                    full_text = []
-                    for para in doc.paragraphs:
-                        full_text.append(para.text)
-                    return '\n'.join(full_text)
+                    return _extract_docx_text(fh)
                 except ImportError:
-                    logger.error("python-docx not installed, cannot read .docx")
+                    logger.error("lxml not installed, cannot read .docx")
                     return None
                 except Exception as e:
                     logger.error(f"Error parsing DOCX {file_id}: {e}")
@@ -106,14 +171,9 @@ class DriveConnector:
 
             elif mime_type == 'application/pdf':
                 try:
-                    import pypdf
-                    reader = pypdf.PdfReader(io.BytesIO(content_bytes))
-                    full_text = []
-                    for page in reader.pages:
-                        full_text.append(page.extract_text() or "")
-                    return '\n'.join(full_text)
+                    return _extract_pdf_text(fh)
                 except ImportError:
-                    logger.error("pypdf not installed, cannot read .pdf")
+                    logger.error("Neither pypdfium2 nor pypdf installed, cannot read .pdf")
                     return None
                 except Exception as e:
                     logger.error(f"Error parsing PDF {file_id}: {e}")
@@ -121,7 +181,7 @@ class DriveConnector:
             
             # 4. Fallback: Try decoding as UTF-8 text
             try:
-                return content_bytes.decode('utf-8')
+                return str(fh.getbuffer(), 'utf-8')
             except UnicodeDecodeError:
                 logger.warning(f"File {file_id} ({mime_type}) is binary and not a supported format (PDF/DOCX). Skipping.")
                 return None
@@ -1,7 +1,10 @@
+import hashlib
 import logging
+import sqlite3
+import threading
 import uuid
-from typing import List, Dict, Any
-from bs4 import BeautifulSoup
+from array import array
+from typing import List, Dict, Any, Optional
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
@@ -9,12 +12,50 @@ from .config import Config
 
 logger = logging.getLogger("rag_sync.ingestion")
 
+class EmbeddingCache:
+    """
+    Persistent chunk text -> embedding cache (SQLite). Boilerplate shared by many documents
+    (headers, legal footers) and unchanged chunks of re-synced files are embedded only once.
+    Keys include the model name; vectors are stored as float32 blobs. Thread-safe.
+    """
+    def __init__(self, path: str, model: str):
+        self.model = model
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+        self._db.commit()
+
+    def key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.model}\0{text}".encode('utf-8'), digest_size=16).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        found = {}
+        with self._lock:
+            # Chunked to stay under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i+500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+        return found
+
+    def put_many(self, items: Dict[bytes, List[float]]):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                ((key, array('f', vector).tobytes()) for key, vector in items.items())
+            )
+            self._db.commit()
+
 class Processor:
     def __init__(self, api_key: str):
         self.embeddings_model = GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004",
+            model=Config.EMBEDDING_MODEL,
             google_api_key=api_key
         )
+        self.embedding_cache = EmbeddingCache(Config.EMBED_CACHE_PATH, Config.EMBEDDING_MODEL) if Config.EMBED_CACHE_PATH else None
         # LangChain Chunker: Más inteligente que un split simple
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=Config.CHUNK_SIZE,
@@ -27,13 +68,25 @@ class Processor:
         """Convierte HTML de Salesforce Knowledge en texto plano limpio."""
         if not html_content:
             return ""
-        soup = BeautifulSoup(html_content, "html.parser")
-        # Eliminar scripts y estilos
-        for script in soup(["script", "style"]):
-            script.extract()
-        
-        # Obtener texto con saltos de línea coherentes
-        text = soup.get_text(separator='\n')
+        try:
+            # selectolax (lexbor, en C): mucho más rápido que BeautifulSoup + html.parser
+            from selectolax.parser import HTMLParser
+        except ImportError:
+            HTMLParser = None
+
+        if HTMLParser is not None:
+            tree = HTMLParser(html_content)
+            # Eliminar scripts y estilos
+            for node in tree.css("script, style"):
+                node.decompose()
+            # Obtener texto con saltos de línea coherentes
+            text = tree.root.text(separator='\n') if tree.root is not None else ""
+        else:
+            from bs4 import BeautifulSoup
+            soup = BeautifulSoup(html_content, "html.parser")
+            for script in soup(["script", "style"]):
+                script.extract()
+            text = soup.get_text(separator='\n')
         
         # Limpiar espacios en blanco extra
         lines = (line.strip() for line in text.splitlines())
@@ -44,6 +97,16 @@ class Processor:
 
     def process_content(self, text_content: str, metadata: Dict[str, Any], is_html: bool = False) -> List[Dict[str, Any]]:
         """Limpia, trocea y genera embeddings para cualquier contenido."""
+        chunks = self.chunk_only(text_content, is_html)
+        if not chunks:
+            return []
+        embeddings = self.embed_chunks(chunks)
+        if embeddings is None:
+            return []
+        return self.build_vectors(chunks, embeddings, metadata)
+
+    def chunk_only(self, text_content: str, is_html: bool = False) -> List[str]:
+        """Limpia y trocea el contenido, sin generar embeddings."""
         
         # 1. Limpieza si es necesario
         if is_html:
@@ -55,29 +118,47 @@ class Processor:
         # 2. Chunking con LangChain
         chunks = self.text_splitter.split_text(text_content)
         logger.info(f"Contenido dividido en {len(chunks)} chunks.")
+        return chunks
 
-        # 3. Generar Embeddings masivos
+    def embed_chunks(self, chunks: List[str]) -> Optional[List[List[float]]]:
+        """
+        Genera los embeddings de chunks de uno o varios ficheros en una sola llamada.
+        Devuelve None si falla (los ficheros afectados se reintentan en la siguiente ejecución).
+        Con la caché activa, solo se piden a la API los textos (únicos) que no estén en ella.
+        """
+        if self.embedding_cache is None:
+            return self._embed(chunks)
+
+        keys = [self.embedding_cache.key(chunk) for chunk in chunks]
+        found = self.embedding_cache.get_many(list(set(keys)))
+        missing = {key: chunk for key, chunk in zip(keys, chunks) if key not in found}
+        if missing:
+            embedded = self._embed(list(missing.values()))
+            if embedded is None:
+                return None
+            fresh = dict(zip(missing, embedded))
+            self.embedding_cache.put_many(fresh)
+            found.update(fresh)
+        logger.info("Embeddings: %d chunks, %d desde caché", len(chunks), len(chunks) - len(missing))
+        return [found[key] for key in keys]
+
+    def _embed(self, chunks: List[str]) -> Optional[List[List[float]]]:
         try:
             # LangChain maneja el batching automáticamente
-            embeddings = self.embeddings_model.embed_documents(chunks)
+            return self.embeddings_model.embed_documents(chunks)
         except Exception as e:
-            logger.error(f"Error generando embeddings: {e}")
-            return []
+            logger.error(f"Error generando embeddings ({len(chunks)} chunks): {e}")
+            return None
 
-        # 4. Formatear para Pinecone
-        vectors = []
-        for i, (chunk_text, embedding) in enumerate(zip(chunks, embeddings)):
-            vector_id = f"{metadata['file_id']}_{i}"
-            
-            # Combinamos metadata original con el texto del chunk
-            chunk_metadata = metadata.copy()
-            chunk_metadata["text"] = chunk_text
-            chunk_metadata["chunk_index"] = i
-            
-            vectors.append({
-                "id": vector_id,
+    def build_vectors(self, chunks: List[str], embeddings: List[List[float]], metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Formatea los chunks de un fichero para Pinecone."""
+        # Metadata original + texto del chunk, construida en un solo literal por chunk
+        file_id = metadata['file_id']
+        return [
+            {
+                "id": f"{file_id}_{i}",
                 "values": embedding,
-                "metadata": chunk_metadata
-            })
-            
-        return vectors
+                "metadata": {**metadata, "text": chunk_text, "chunk_index": i}
+            }
+            for i, (chunk_text, embedding) in enumerate(zip(chunks, embeddings))
+        ]
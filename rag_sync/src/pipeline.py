@@ -1,5 +1,7 @@
+import hashlib
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Any
 
 from .config import Config
@@ -11,6 +13,41 @@ from .vector_store import VectorStore
 
 logger = logging.getLogger("rag_sync.pipeline")
 
+def _content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+class _ChunkBatcher:
+    """
+    Collects the chunks of several files and embeds them together: once `batch_size`
+    chunks are queued, the batch is embedded (one API call) and upserted on `executor`.
+    """
+    def __init__(self, pipeline, executor, batch_size):
+        self.pipeline = pipeline
+        self.executor = executor
+        self.batch_size = batch_size
+        self._files = []  # (chunks, meta, modified_time, content_hash, replace)
+        self._size = 0
+        self._futures = []
+
+    def add(self, chunks, meta, modified_time, content_hash, replace=False):
+        if not chunks:
+            return
+        self._files.append((chunks, meta, modified_time, content_hash, replace))
+        self._size += len(chunks)
+        if self._size >= self.batch_size:
+            self._submit()
+
+    def _submit(self):
+        if self._files:
+            self._futures.append(self.executor.submit(self.pipeline._embed_and_upsert, self._files))
+            self._files, self._size = [], 0
+
+    def close(self):
+        """Sends the last partial batch and waits for all of them (re-raising their errors)."""
+        self._submit()
+        for future in self._futures:
+            future.result()
+
 class SyncPipeline:
     def __init__(self):
         Config.validate()
@@ -28,12 +65,22 @@ class SyncPipeline:
     def run(self):
         logger.info("--- Iniciando Sincronización Híbrida (Drive + Salesforce) ---")
         
-        # 1. Ejecutar Sincronización de Google Drive
-        self.sync_google_drive()
-        
-        # 2. Ejecutar Sincronización de Salesforce Knowledge
-        if Config.SF_USERNAME:
-            self.sync_salesforce_knowledge()
+        try:
+            if Config.SF_USERNAME and not self.state_manager.has_untagged_entries():
+                # Drive y Salesforce no comparten entradas de estado: se sincronizan a la vez
+                with ThreadPoolExecutor(max_workers=2) as pool:
+                    futures = [pool.submit(self.sync_google_drive), pool.submit(self.sync_salesforce_knowledge)]
+                    for future in futures:
+                        future.result()
+            else:
+                # Estado antiguo sin origen por entrada: en secuencia, Salesforce primero para que
+                # marque sus artículos antes de que Drive calcule los eliminados
+                if Config.SF_USERNAME:
+                    self.sync_salesforce_knowledge()
+                self.sync_google_drive()
+        finally:
+            # El estado se guarda por lotes: escribir lo pendiente aunque algo falle
+            self.state_manager.flush()
         
         logger.info("--- Sincronización Finalizada con Éxito ---")
 
@@ -43,27 +90,44 @@ class SyncPipeline:
             drive_files = self.drive.list_files_in_folder(Config.GOOGLE_DRIVE_FOLDER_ID)
             remote_files_map = {f['id']: f for f in drive_files if f.get('mimeType') != 'application/vnd.google-apps.folder'}
             
-            local_file_ids = self.state_manager.get_all_file_ids()
-            remote_file_ids = set(remote_files_map.keys())
-
-            # Detectar cambios
-            added = remote_file_ids - local_file_ids
-            removed = local_file_ids - remote_file_ids
+            self.state_manager.claim_untagged(remote_files_map, "google_drive")
+            # Detectar cambios: nuevos + modificados (según DELTA_STRATEGY) y eliminados
+            added, removed = self.state_manager.diff_against(remote_files_map.keys(), source="google_drive")
+            to_fetch = [fid for fid, f in remote_files_map.items() if self._needs_fetch(fid, f['modifiedTime'])]
             
-            # Procesar
-            for fid in removed:
-                self.vector_store.delete_by_file_id(fid)
-                self.state_manager.remove_file(fid)
+            # Procesar: un único borrado (por lotes) para todos los ficheros eliminados
+            if removed:
+                self._delete_vectors(removed)
+                for fid in removed:
+                    self.state_manager.remove_file(fid)
             
-            for fid in added:
-                f_meta = remote_files_map[fid]
-                content = self.drive.download_file_content(fid, f_meta['mimeType'])
-                if content:
+            # Descargas (y parseo DOCX/PDF) en paralelo; cada contenido listo se trocea y
+            # sus chunks se agrupan con los de otros ficheros para generar los embeddings
+            # por lotes en un segundo pool (que también sube a Pinecone)
+            with ThreadPoolExecutor(max_workers=Config.DRIVE_DOWNLOAD_WORKERS) as downloads, \
+                 ThreadPoolExecutor(max_workers=Config.INGEST_WORKERS) as ingestion:
+                futures = {
+                    downloads.submit(self.drive.download_file_content, fid, remote_files_map[fid]['mimeType']): fid
+                    for fid in to_fetch
+                }
+                batcher = _ChunkBatcher(self, ingestion, Config.EMBED_BATCH_CHUNKS)
+                for future in as_completed(futures):
+                    fid = futures[future]
+                    f_meta = remote_files_map[fid]
+                    content = future.result()
+                    if not content:
+                        continue
+                    content_hash = _content_hash(content)
+                    if self._content_unchanged(fid, content_hash):
+                        # Solo cambió el mtime (metadatos): no se regeneran embeddings
+                        self.state_manager.update_file(fid, f_meta['modifiedTime'], content_hash, source="google_drive")
+                        continue
                     meta = {"file_id": fid, "file_name": f_meta['name'], "source": "google_drive"}
-                    vectors = self.processor.process_content(content, meta)
-                    if vectors:
-                        self.vector_store.upsert(vectors)
-                        self.state_manager.update_file(fid, f_meta['modifiedTime'])
+                    batcher.add(
+                        self.processor.chunk_only(content), meta, f_meta['modifiedTime'], content_hash,
+                        replace=fid not in added
+                    )
+                batcher.close()
 
         except Exception as e:
             logger.error(f"Error en sincronización Drive: {e}")
@@ -72,33 +136,110 @@ class SyncPipeline:
         logger.info("Sincronizando Salesforce Knowledge...")
         try:
             articles = self.sf.get_knowledge_articles()
-            
-            for art in articles:
-                art_id = art['Id']
-                remote_mod = art['LastModifiedDate']
-                local_mod = self.state_manager.get_modified_time(art_id)
-
-                if remote_mod != local_mod:
-                    logger.info(f"Actualizando artículo SF: {art['Title']}")
-                    
-                    # Obtener contenido completo
-                    details = self.sf.get_article_details(art_id)
-                    if details:
-                        # Eliminar versiones viejas en Pinecone
-                        self.vector_store.delete_by_file_id(art_id)
-                        
-                        # Procesar nuevo contenido (HTML -> Text -> Chunks -> Embeddings)
-                        meta = {
-                            "file_id": art_id,
-                            "file_name": details['title'],
-                            "source": "salesforce_knowledge",
-                            "url": f"{Config.SF_DOMAIN}.lightning.force.com/{art_id}"
-                        }
-                        
-                        vectors = self.processor.process_content(details['html'], meta, is_html=True)
-                        if vectors:
-                            self.vector_store.upsert(vectors)
-                            self.state_manager.update_file(art_id, remote_mod)
+            if articles is None:
+                # Sin listado no se sabe qué se despublicó: no se toca nada
+                logger.error("No se pudo listar Salesforce Knowledge; se omite la sincronización")
+                return
+            self.state_manager.claim_untagged((art['Id'] for art in articles), "salesforce_knowledge")
+
+            # Artículos despublicados/archivados (o versiones sustituidas): fuera del índice.
+            # Las entradas sin origen que queden tras el claim son de Drive (o huérfanas): las barre Drive
+            _, removed = self.state_manager.diff_against(
+                {art['Id'] for art in articles}, source="salesforce_knowledge", include_untagged=False
+            )
+            if removed:
+                self._delete_vectors(removed)
+                for art_id in removed:
+                    self.state_manager.remove_file(art_id)
+
+            changed = [art for art in articles if self._needs_fetch(art['Id'], art['LastModifiedDate'])]
+
+            # Obtener contenido completo (una query por cada 200 artículos)
+            all_details = self.sf.get_article_details_bulk(art['Id'] for art in changed)
+
+            # Descartar los que solo cambiaron metadatos
+            to_ingest = []
+            for art in changed:
+                details = all_details.get(art['Id'])
+                if not details:
+                    continue
+                content_hash = _content_hash(details['html'])
+                if self._content_unchanged(art['Id'], content_hash):
+                    self.state_manager.update_file(art['Id'], art['LastModifiedDate'], content_hash, source="salesforce_knowledge")
+                else:
+                    to_ingest.append((art, details, content_hash))
+
+            # Embeddings por lotes de chunks de varios artículos
+            with ThreadPoolExecutor(max_workers=Config.INGEST_WORKERS) as executor:
+                batcher = _ChunkBatcher(self, executor, Config.EMBED_BATCH_CHUNKS)
+                for art, details, content_hash in to_ingest:
+                    self._sync_article(batcher, art, details, content_hash)
+                batcher.close()
         
         except Exception as e:
             logger.error(f"Error en sincronización Salesforce: {e}")
+
+    def _sync_article(self, batcher, art, details, content_hash):
+        art_id = art['Id']
+        logger.info(f"Actualizando artículo SF: {art['Title']}")
+        
+        # Procesar nuevo contenido (HTML -> Text -> Chunks; los embeddings, en el lote)
+        meta = {
+            "file_id": art_id,
+            "file_name": details['title'],
+            "source": "salesforce_knowledge",
+            "url": f"{Config.SF_DOMAIN}.lightning.force.com/{art_id}"
+        }
+        # Los artículos ya indexados se sobrescriben por id (sin borrado previo)
+        replace = self.state_manager.get_modified_time(art_id) is not None
+        batcher.add(self.processor.chunk_only(details['html'], is_html=True), meta, art['LastModifiedDate'], content_hash, replace=replace)
+
+    def _needs_fetch(self, file_id, remote_mod):
+        """Whether the file/article content has to be downloaded (new or modified)."""
+        return Config.DELTA_STRATEGY == "always" or remote_mod != self.state_manager.get_modified_time(file_id)
+
+    def _content_unchanged(self, file_id, content_hash):
+        """Metadata-only change: same content as the last embedded version."""
+        return Config.DELTA_STRATEGY == "hash" and content_hash == self.state_manager.get_hash(file_id)
+
+    def _embed_and_upsert(self, files):
+        """
+        Genera los embeddings de los chunks de varios ficheros en una llamada y sube los
+        vectores de cada fichero, registrándolo en el estado. Con `replace` el fichero ya
+        estaba indexado: los ids son deterministas ("{file_id}_{i}"), así que el upsert
+        sobrescribe los chunks existentes y solo se borran los sobrantes de la versión anterior.
+        """
+        embeddings = self.processor.embed_chunks([chunk for chunks, *_ in files for chunk in chunks])
+        if embeddings is None:
+            return
+        offset = 0
+        for chunks, meta, modified_time, content_hash, replace in files:
+            vectors = self.processor.build_vectors(chunks, embeddings[offset:offset + len(chunks)], meta)
+            offset += len(chunks)
+            old_ids = self.state_manager.get_vector_ids(meta['file_id']) if replace else None
+            if replace and old_ids is None:
+                # Sin número de chunks conocido: borrado completo por metadata antes de subir
+                self._delete_vectors([meta['file_id']])
+            self.vector_store.upsert(vectors)
+            if old_ids is not None and len(old_ids) > len(vectors):
+                self.vector_store.delete_by_ids(old_ids[len(vectors):])
+            self.state_manager.update_file(
+                meta['file_id'], modified_time, content_hash, chunks=len(vectors), source=meta['source']
+            )
+
+    def _delete_vectors(self, file_ids):
+        """
+        Borra los vectores de estos ficheros: por id cuando el estado conoce sus chunks
+        (barato para Pinecone) y por filtro de metadata solo para los desconocidos.
+        """
+        ids, unknown = [], []
+        for fid in file_ids:
+            vector_ids = self.state_manager.get_vector_ids(fid)
+            if vector_ids is None:
+                unknown.append(fid)
+            else:
+                ids.extend(vector_ids)
+        if ids:
+            self.vector_store.delete_by_ids(ids)
+        if unknown:
+            self.vector_store.delete_by_file_ids(unknown)
@@ -1,12 +1,18 @@
 import logging
 import os
 import requests
+from requests.adapters import HTTPAdapter
 from simple_salesforce import Salesforce
 from .config import Config
 
 logger = logging.getLogger("rag_sync.sf_connector")
 
 class SalesforceConnector:
+    # El listado solo trae lo necesario para detectar cambios; el cuerpo (ArticleBody__c)
+    # se pide en get_article_details, y solo para los artículos modificados
+    _LIST_QUERY = "SELECT Id, Title, LastModifiedDate FROM Knowledge__kav WHERE IsLatestVersion = true AND PublishStatus = 'Online' AND Language = 'es'"
+    _LIST_QUERY_ANY_LANGUAGE = "SELECT Id, Title, LastModifiedDate FROM Knowledge__kav WHERE IsLatestVersion = true AND PublishStatus = 'Online'"
+
     def __init__(self):
         username = os.getenv("SF_USERNAME")
         password = os.getenv("SF_PASSWORD")
@@ -15,6 +21,11 @@ class SalesforceConnector:
         client_secret = os.getenv("SF_CLIENT_SECRET")
         domain_raw = os.getenv("SF_DOMAIN", "login")
 
+        # Una sesión con pool keep-alive para OAuth y todas las llamadas REST de simple_salesforce
+        # (sin ella cada petición puede pagar su propio handshake TLS)
+        self._http = requests.Session()
+        self._http.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64))
+
         if not all([username, password, token, client_id, client_secret]):
             missing = []
             if not username: missing.append("SF_USERNAME")
@@ -48,7 +59,7 @@ class SalesforceConnector:
                 'password': f"{password}{token}" # Combinación estándar
             }
             
-            response = requests.post(auth_url, data=payload)
+            response = self._http.post(auth_url, data=payload)
             response.raise_for_status()
             auth_data = response.json()
             
@@ -58,7 +69,8 @@ class SalesforceConnector:
             # Paso 2: Inicializar Salesforce con el token ya obtenido
             self.sf = Salesforce(
                 instance_url=instance_url,
-                session_id=access_token
+                session_id=access_token,
+                session=self._http
             )
             logger.info("¡Conexión REST OAuth2 exitosa con Salesforce!")
             
@@ -69,38 +81,58 @@ class SalesforceConnector:
             self.sf = None
 
     def get_knowledge_articles(self):
+        """
+        Artículos publicados (Id, Title, LastModifiedDate). None si no hay conexión o la query
+        falla: no es lo mismo que una lista vacía (el pipeline borraría todos los artículos).
+        """
         if not self.sf:
-            return []
+            return None
 
-        # SOQL optimizado para REST
-        query = "SELECT Id, Title, ArticleBody__c, LastModifiedDate FROM Knowledge__kav WHERE IsLatestVersion = true AND PublishStatus = 'Online' AND Language = 'es'"
-        
         try:
-            results = self.sf.query_all(query)
+            results = self.sf.query_all(self._LIST_QUERY)
             articles = results.get('records', [])
             logger.info(f"Se han encontrado {len(articles)} artículos vía REST API.")
             return articles
         except Exception as e:
             logger.warning(f"Error query inicial (Language): {str(e)}")
             try:
-                query_retry = "SELECT Id, Title, ArticleBody__c, LastModifiedDate FROM Knowledge__kav WHERE IsLatestVersion = true AND PublishStatus = 'Online'"
-                results = self.sf.query_all(query_retry)
+                results = self.sf.query_all(self._LIST_QUERY_ANY_LANGUAGE)
                 return results.get('records', [])
             except Exception as e2:
                 logger.error(f"Error total en REST query: {str(e2)}")
-                return []
+                return None
 
     def get_article_details(self, article_id: str):
         try:
-            # Los campos ya vienen en la query principal para mayor eficiencia
-            article = self.sf.Knowledge__kav.get(article_id)
-            content_html = f"<h3>{article.get('Title')}</h3><div>{article.get('ArticleBody__c', '')}</div>"
-            return {
-                "id": article['Id'],
-                "title": article['Title'],
-                "html": content_html,
-                "modified": article['LastModifiedDate']
-            }
+            return self._details(self.sf.Knowledge__kav.get(article_id))
         except Exception as e:
             logger.error(f"Error en detalle REST para {article_id}: {e}")
             return None
+
+    def get_article_details_bulk(self, article_ids, batch_size: int = 200):
+        """
+        Detalle de varios artículos con una query SOQL `Id IN (...)` por cada `batch_size` ids
+        (en vez de un GET por artículo). Devuelve {Id: detalle}; los que fallen no aparecen.
+        """
+        article_ids = list(article_ids)
+        details = {}
+        for i in range(0, len(article_ids), batch_size):
+            batch = article_ids[i:i+batch_size]
+            ids = ", ".join(f"'{article_id}'" for article_id in batch)
+            try:
+                results = self.sf.query_all(f"SELECT Id, Title, ArticleBody__c, LastModifiedDate FROM Knowledge__kav WHERE Id IN ({ids})")
+                for article in results.get('records', []):
+                    details[article['Id']] = self._details(article)
+            except Exception as e:
+                logger.error(f"Error en detalle REST para {len(batch)} artículos: {e}")
+        return details
+
+    @staticmethod
+    def _details(article):
+        content_html = f"<h3>{article.get('Title')}</h3><div>{article.get('ArticleBody__c', '')}</div>"
+        return {
+            "id": article['Id'],
+            "title": article['Title'],
+            "html": content_html,
+            "modified": article['LastModifiedDate']
+        }
@@ -1,23 +1,47 @@
-import json
+import orjson
 import os
+import threading
+import time
 import logging
-from typing import Dict, Optional
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
 from datetime import datetime
 
 logger = logging.getLogger("rag_sync.state")
 
 class StateManager:
-    def __init__(self, state_file: str):
+    """
+    Sync state (file_id -> {"mtime", "hash", "chunks", "source"}) persisted as JSON. The content
+    hash lets the pipeline skip re-embedding files whose modified time changed but whose text
+    didn't; the chunk count gives the file's vector ids ("{file_id}_{i}") for id-based deletes;
+    the source keeps each sync (Drive, Salesforce) to its own entries.
+    Thread-safe: Drive and Salesforce sync (and their ingestion threads) share one instance.
+    Changes are written in batches: with `autosave`, the file is rewritten at most every
+    `save_interval` seconds or every `max_pending` changes, and `flush()` writes whatever
+    is left (call it at the end of a run). Without `autosave`, only `flush()`/`save()` write.
+    """
+    def __init__(self, state_file: str, autosave: bool = True, save_interval: float = 5.0, max_pending: int = 100):
         self.state_file = state_file
-        self.state: Dict[str, str] = {}  # file_id -> modified_time
+        self.state: Dict[str, Dict[str, Any]] = {}  # file_id -> {"mtime", "hash", "chunks", "source"}
+        self._lock = threading.RLock()
+        self.autosave = autosave
+        self.save_interval = save_interval
+        self.max_pending = max_pending
+        self._pending = 0  # Changes not yet written
+        self._ids: Optional[FrozenSet[str]] = None  # Cached key set, dropped when a file is added/removed
+        self._last_save = time.monotonic()
         self.load()
 
     def load(self):
+        self._ids = None
         if os.path.exists(self.state_file):
             try:
-                with open(self.state_file, 'r') as f:
-                    data = json.load(f)
-                    self.state = data.get("files", {})
+                with open(self.state_file, 'rb') as f:
+                    data = orjson.loads(f.read())
+                # Old states stored just the modified time (no hash: the next change re-embeds)
+                self.state = {
+                    fid: entry if isinstance(entry, dict) else {"mtime": entry, "hash": None}
+                    for fid, entry in data.get("files", {}).items()
+                }
                 logger.info(f"Loaded state with {len(self.state)} files.")
             except Exception as e:
                 logger.error(f"Failed to load state file: {e}")
@@ -27,31 +51,101 @@ class StateManager:
             self.state = {}
 
     def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
         try:
-            data = {
+            data = orjson.dumps({
                 "last_run": datetime.utcnow().isoformat(),
                 "files": self.state
-            }
-            # Atomic write pattern to avoid corruption
+            })
+            # Atomic write pattern to avoid corruption (serialized first, then one write)
             temp_file = self.state_file + ".tmp"
-            with open(temp_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            with open(temp_file, 'wb') as f:
+                f.write(data)
             os.replace(temp_file, self.state_file)
+            self._pending = 0
+            self._last_save = time.monotonic()
             logger.debug("State saved successfully.")
         except Exception as e:
             logger.error(f"Failed to save state: {e}")
 
     def get_modified_time(self, file_id: str) -> Optional[str]:
-        return self.state.get(file_id)
+        entry = self.state.get(file_id)
+        return entry["mtime"] if entry else None
+
+    def get_hash(self, file_id: str) -> Optional[str]:
+        entry = self.state.get(file_id)
+        return entry["hash"] if entry else None
+
+    def get_vector_ids(self, file_id: str) -> Optional[List[str]]:
+        """Ids of the file's vectors in Pinecone, or None if unknown (entries from older states)."""
+        entry = self.state.get(file_id)
+        chunks = entry.get("chunks") if entry else None
+        return None if chunks is None else [f"{file_id}_{i}" for i in range(chunks)]
+
+    def flush(self):
+        """Writes the state if there are unsaved changes."""
+        with self._lock:
+            if self._pending:
+                self._save()
 
-    def update_file(self, file_id: str, modified_time: str):
-        self.state[file_id] = modified_time
-        self.save()
+    def _changed(self):
+        self._pending += 1
+        if self.autosave and (self._pending >= self.max_pending or time.monotonic() - self._last_save >= self.save_interval):
+            self._save()
+
+    def update_file(self, file_id: str, modified_time: str, content_hash: Optional[str] = None,
+                    chunks: Optional[int] = None, source: Optional[str] = None):
+        """`chunks` is the number of vectors upserted; None keeps the known count (metadata-only update)."""
+        with self._lock:
+            entry = self.state.get(file_id)
+            if entry is None:
+                self._ids = None
+            else:
+                chunks = entry.get("chunks") if chunks is None else chunks
+                source = source or entry.get("source")
+            self.state[file_id] = {"mtime": modified_time, "hash": content_hash, "chunks": chunks, "source": source}
+            self._changed()
 
     def remove_file(self, file_id: str):
-        if file_id in self.state:
-            del self.state[file_id]
-            self.save()
+        with self._lock:
+            if file_id in self.state:
+                del self.state[file_id]
+                self._ids = None
+                self._changed()
+
+    def get_all_file_ids(self) -> FrozenSet[str]:
+        with self._lock:
+            if self._ids is None:
+                self._ids = frozenset(self.state)
+            return self._ids
+
+    def has_untagged_entries(self) -> bool:
+        """Entries from states written before sources were recorded (any sync may own them)."""
+        with self._lock:
+            return any(entry.get("source") is None for entry in self.state.values())
+
+    def claim_untagged(self, file_ids, source: str):
+        """Records `source` on the given entries that don't have one yet."""
+        with self._lock:
+            for fid in file_ids:
+                entry = self.state.get(fid)
+                if entry is not None and entry.get("source") is None:
+                    entry["source"] = source
+                    self._changed()
 
-    def get_all_file_ids(self):
-        return set(self.state.keys())
+    def diff_against(self, remote_ids: Set[str], source: Optional[str] = None,
+                     include_untagged: bool = True) -> Tuple[Set[str], Set[str]]:
+        """
+        (added, removed): remote ids not in the state, and state ids no longer remote.
+        With `source`, only that source's entries (and untagged ones, unless
+        `include_untagged` is False) count as local.
+        """
+        local_ids = self.get_all_file_ids()
+        if source is not None:
+            owners = (source, None) if include_untagged else (source,)
+            with self._lock:
+                local_ids = {fid for fid in local_ids if self.state[fid].get("source") in owners}
+        return remote_ids - local_ids, local_ids - remote_ids
@@ -17,28 +17,42 @@ class VectorStore:
         # Ensure index exists (optional check, usually assumed created via IaC)
         # We'll just connect.
         try:
-            self.index = self.pc.Index(index_name)
+            # pool_threads backs the async_req upserts
+            self.index = self.pc.Index(index_name, pool_threads=Config.PINECONE_POOL_THREADS)
         except Exception as e:
             logger.error(f"Failed to connect to Pinecone index {index_name}: {e}")
             raise
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     def upsert(self, vectors: List[Dict[str, Any]]):
         """
-        Batch upsert vectors.
+        Batch upsert vectors. All batches are sent at once (async_req) so their network
+        round-trips overlap; a batch that fails is retried on its own, without resending
+        the batches that already succeeded.
         """
         if not vectors:
             return
 
-        batch_size = 100
-        for i in range(0, len(vectors), batch_size):
-            batch = vectors[i:i+batch_size]
+        batch_size = Config.PINECONE_UPSERT_BATCH
+        batches = [vectors[i:i+batch_size] for i in range(0, len(vectors), batch_size)]
+        pending = [
+            self.index.upsert(vectors=batch, namespace=self.namespace, async_req=True)
+            for batch in batches
+        ]
+        for n, (batch, result) in enumerate(zip(batches, pending)):
             try:
-                self.index.upsert(vectors=batch, namespace=self.namespace)
-                logger.debug(f"Upserted batch {i} to {i+len(batch)}")
+                result.get()
+                logger.debug("Upserted batch %d to %d", n * batch_size, n * batch_size + len(batch))
             except Exception as e:
-                logger.error(f"Failed to upsert batch: {e}")
-                raise
+                logger.warning(f"Async upsert of batch {n} failed ({e}), retrying it")
+                self._upsert_batch(batch)
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    def _upsert_batch(self, batch: List[Dict[str, Any]]):
+        try:
+            self.index.upsert(vectors=batch, namespace=self.namespace)
+        except Exception as e:
+            logger.error(f"Failed to upsert batch: {e}")
+            raise
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     def delete_by_file_id(self, file_id: str):
@@ -54,4 +68,39 @@ class VectorStore:
             logger.info(f"Deleted vectors for file_id: {file_id}")
         except Exception as e:
             logger.error(f"Failed to delete vectors for {file_id}: {e}")
-            raise 
+            raise
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    def delete_by_ids(self, ids: List[str], batch_size: int = 1000):
+        """
+        Delete vectors by id, `batch_size` ids per request. Much cheaper for Pinecone
+        than metadata-filter deletes (no server-side scan).
+        """
+        ids = list(ids)
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i+batch_size]
+            try:
+                self.index.delete(ids=batch, namespace=self.namespace)
+                logger.debug("Deleted %d vectors by id", len(batch))
+            except Exception as e:
+                logger.error(f"Failed to delete {len(batch)} vectors by id: {e}")
+                raise
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    def delete_by_file_ids(self, file_ids: List[str], batch_size: int = 1000):
+        """
+        Delete all vectors of several files with one `$in` metadata-filter request
+        per `batch_size` ids (instead of one request per file).
+        """
+        file_ids = list(file_ids)
+        for i in range(0, len(file_ids), batch_size):
+            batch = file_ids[i:i+batch_size]
+            try:
+                self.index.delete(
+                    filter={"file_id": {"$in": batch}},
+                    namespace=self.namespace
+                )
+                logger.info(f"Deleted vectors for {len(batch)} file_ids")
+            except Exception as e:
+                logger.error(f"Failed to delete vectors for {len(batch)} file_ids: {e}")
+                raise 
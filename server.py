@@ -1,6 +1,8 @@
+import os
 import uvicorn
-from api.index import app
 
 if __name__ == "__main__":
     print("Iniciando Aquaservice AI Local (v2.2)...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # With uvicorn[standard] installed, the default loop/http ("auto") are uvloop and httptools.
+    # Workers need the app as an import string; caches and sessions are per worker process.
+    uvicorn.run("api.index:app", host="0.0.0.0", port=8000, workers=int(os.getenv("WEB_CONCURRENCY", "1")))